@@ -0,0 +1,205 @@
+"""
+Persistent SQLite cache for web API responses, shared by the identifier scripts so reruns do not repeat lookups.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DAY = 24 * 60 * 60
+
+# How long a stored response stays valid per endpoint, in seconds
+DEFAULT_TTL = {
+    'cas_search': 30 * DAY,
+    'cas_detail': 90 * DAY,
+    'pc_name': 30 * DAY,
+    'pc_inchi': 90 * DAY,
+    'pc_cid': 90 * DAY,
+    'pc_name_cids': 30 * DAY,
+    'pc_inchi_cids': 90 * DAY,
+    'pc_property': 90 * DAY,
+    'pc_synonyms': 90 * DAY,
+}
+FALLBACK_TTL = 30 * DAY
+
+# Empty results are cached for a shorter time, the services might add the compound later on
+NEGATIVE_TTL = 7 * DAY
+
+# Endpoints queried by compound name only, where letter case does not change the meaning of the query.
+# Other queries can be SMILES or InChI strings where it does (c1ccccc1 is benzene, C1CCCCC1 cyclohexane), these keys keep their case
+CASE_INSENSITIVE_PREFIX = 'pc_name'
+
+# Maximum amount of stored responses, the least recently used responses are removed above this
+MAX_ENTRIES = 200000
+
+# Access times of cache hits are written in batches of this many, instead of a write and commit for every hit
+ACCESS_BATCH = 1000
+
+
+class ResponseCache:
+    '''
+    Stores API responses as JSON with an expiry per endpoint, evicting the least recently used entries when full.
+    Safe to use from multiple threads.
+    '''
+
+    def __init__(self, path:str = "api_cache.db", ttl=None, negative_ttl:float = NEGATIVE_TTL, max_entries:int = MAX_ENTRIES):
+        self.ttl = dict(DEFAULT_TTL)
+        self.ttl.update(ttl or {})
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        # Hit and miss counters per endpoint
+        self.hits = {}
+        self.misses = {}
+
+        # Access times of hits that are not yet written, (endpoint, query): time
+        self.accessed = {}
+
+        # WAL mode with synchronous=NORMAL, so a commit appends to the log without waiting for the disk (see storage.connect)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses(endpoint TEXT NOT NULL,
+                                                                 query TEXT NOT NULL,
+                                                                 value TEXT,
+                                                                 empty INTEGER NOT NULL,
+                                                                 stored_at REAL NOT NULL,
+                                                                 accessed_at REAL NOT NULL,
+                                                                 PRIMARY KEY(endpoint, query))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)')
+        self.conn.commit()
+
+        # Counting the table on every write is wasteful, the size is tracked in memory after one count
+        self.size = self.conn.execute('SELECT count(*) FROM responses').fetchone()[0]
+
+    def key(self, endpoint:str, query):
+        '''
+        Normalizes a query so small differences in whitespace hit the same entry, and letter case for name queries
+        '''
+        query = ' '.join(str(query).split())
+        if endpoint.startswith(CASE_INSENSITIVE_PREFIX):
+            query = query.lower()
+        return query
+
+    def get(self, endpoint:str, query):
+        '''
+        Returns (True, value) for a valid stored response or (False, None) when there is none
+        '''
+        query = self.key(endpoint, query)
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute('SELECT value, empty, stored_at FROM responses WHERE endpoint = ? AND query = ?', (endpoint, query)).fetchone()
+
+            if row:
+                value, empty, stored_at = row
+                ttl = self.negative_ttl if empty else self.ttl.get(endpoint, FALLBACK_TTL)
+
+                if now - stored_at < ttl:
+                    # The access time only matters for evicting, it is written with the next batch
+                    self.accessed[(endpoint, query)] = now
+                    if len(self.accessed) >= ACCESS_BATCH:
+                        self.write_accessed()
+                        self.conn.commit()
+                    self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+                    metrics.inc('cache_lookups_total', endpoint=endpoint, result="hit")
+                    return True, json.loads(value)
+
+            self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+            metrics.inc('cache_lookups_total', endpoint=endpoint, result="miss")
+            return False, None
+
+    def set(self, endpoint:str, query, value, empty:bool = None):
+        '''
+        Stores a response, by default a response counts as empty when it is falsy
+        '''
+        query = self.key(endpoint, query)
+        now = time.time()
+        if empty is None:
+            empty = not value
+
+        with self.lock:
+            cur = self.conn.execute('SELECT 1 FROM responses WHERE endpoint = ? AND query = ?', (endpoint, query))
+            exists = cur.fetchone() is not None
+
+            self.conn.execute('INSERT OR REPLACE INTO responses(endpoint, query, value, empty, stored_at, accessed_at) VALUES (?,?,?,?,?,?)',
+                              (endpoint, query, json.dumps(value), int(empty), now, now))
+            if not exists:
+                self.size += 1
+            self.accessed.pop((endpoint, query), None)
+
+            # Remove the least recently used entries when the cache grows over its maximum size, with the latest access times
+            if self.size > self.max_entries:
+                self.write_accessed()
+                self.conn.execute('DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY accessed_at LIMIT ?)',
+                                  (self.size - self.max_entries,))
+                self.size = self.max_entries
+            self.conn.commit()
+
+    def write_accessed(self):
+        '''
+        Writes the pending access times of cache hits, does not commit. Call while holding the lock
+        '''
+        if self.accessed:
+            self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND query = ?',
+                                  [(accessed_at, endpoint, query) for (endpoint, query), accessed_at in self.accessed.items()])
+            self.accessed.clear()
+
+    def cached(self, endpoint:str, query, fetch, empty=None):
+        '''
+        Returns the stored response for a query, or calls fetch(query) and stores its result.
+        empty can be a function deciding whether a fetched value counts as an empty result.
+        '''
+        found, value = self.get(endpoint, query)
+        if found:
+            return value
+
+        value = fetch(query)
+        self.set(endpoint, query, value, empty(value) if empty else None)
+        return value
+
+    def stats(self):
+        '''
+        Returns hit and miss counts and the hit rate for every endpoint
+        '''
+        stats = {}
+        for endpoint in set(self.hits) | set(self.misses):
+            hits = self.hits.get(endpoint, 0)
+            misses = self.misses.get(endpoint, 0)
+            stats[endpoint] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+        return stats
+
+    def close(self):
+        '''
+        Writes the pending access times and closes the cache, closing more than once does nothing
+        '''
+        with self.lock:
+            if self.conn is None:
+                return
+            self.write_accessed()
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+
+# All API wrappers share one cache file, PYRODB_CACHE selects another file (keep responses of fake_api.py apart from real ones)
+CACHE_PATH = os.environ.get("PYRODB_CACHE", "api_cache.db")
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    '''
+    Returns the shared response cache, creating it on first use
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(CACHE_PATH)
+            # The access times of the last hits are written when the program exits
+            atexit.register(_cache.close)
+    return _cache
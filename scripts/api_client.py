@@ -0,0 +1,160 @@
+"""
+Shared HTTP machinery for the web API wrappers: a persistent keep-alive session, timeouts,
+retries with exponential backoff and jitter and a token-bucket rate limiter.
+"""
+import random
+import threading
+import time
+
+import requests
+import requests.adapters
+
+import metrics
+
+# Status codes that indicate a temporary problem on the side of the service, these are retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class APIError(Exception):
+    '''
+    Raised when a request could not be completed, even after retrying
+    '''
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    '''
+    Thread safe token-bucket rate limiter.
+    Allows bursts of up to `capacity` requests, refilled at `rate` requests per second.
+    '''
+
+    def __init__(self, rate:float, capacity:int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Blocks until a token is available and takes it
+        '''
+        while True:
+            with self.lock:
+                # Refill the bucket for the time that passed since the last call
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                # Time until the next token becomes available
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class APIClient:
+    '''
+    Base client for a JSON web API.
+    Keeps one requests.Session open so connections are reused between calls instead of doing a new TCP/TLS handshake every time.
+    '''
+
+    def __init__(self, base_url:str, timeout:float = 30.0, retries:int = 5, backoff:float = 1.0,
+                 max_backoff:float = 60.0, rate:float = 5.0, burst:int = 1, concurrency:int = 4):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        self.limit_concurrency(concurrency)
+
+    def limit_concurrency(self, concurrency:int):
+        '''
+        Sets the maximum amount of requests that are in flight at the same time when the client is used from several threads
+        '''
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+        # Keep enough connections in the pool so every thread can reuse its own keep-alive connection
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff_delay(self, attempt:int, retry_after=None):
+        '''
+        Returns the time to wait before the next attempt using exponential backoff with full jitter.
+        A Retry-After header given by the service takes precedence when it asks for a longer wait.
+        '''
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+
+        return delay
+
+    def request(self, method:str, path:str, endpoint:str = None, **kwargs):
+        '''
+        Performs a request against the API, retrying on connection errors and temporary failures.
+        Returns the response or raises an APIError when all attempts failed.
+        endpoint names the request in the metrics, by default the first part of the path.
+        '''
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = endpoint or path.strip('/').split('/')[0]
+
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            retry_after = None
+
+            try:
+                with self.slots, metrics.timer('api_request_seconds', endpoint=endpoint):
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                metrics.inc('api_requests_total', endpoint=endpoint, status="error")
+                failure = APIError(f"{method} {url} failed: {error}")
+            else:
+                metrics.inc('api_requests_total', endpoint=endpoint, status=response.status_code)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                failure = APIError(f"{method} {url} returned {response.status_code}", response.status_code)
+                retry_after = response.headers.get('Retry-After')
+
+            # Wait before trying again, unless this was the last attempt
+            if attempt < self.retries:
+                metrics.inc('api_retries_total', endpoint=endpoint)
+                time.sleep(self.backoff_delay(attempt, retry_after))
+
+        metrics.inc('api_failures_total', endpoint=endpoint)
+        raise failure
+
+    def get_json(self, path:str, params=None, endpoint:str = None):
+        '''
+        GET request returning the decoded JSON body, raises an APIError on any non 200 response
+        '''
+        return self.json_request('GET', path, endpoint, params=params)
+
+    def post_json(self, path:str, data=None, endpoint:str = None):
+        '''
+        POST request with form data returning the decoded JSON body, raises an APIError on any non 200 response
+        '''
+        return self.json_request('POST', path, endpoint, data=data)
+
+    def json_request(self, method:str, path:str, endpoint:str = None, **kwargs):
+        '''
+        Performs a request and decodes the JSON body of a successful response
+        '''
+        response = self.request(method, path, endpoint, **kwargs)
+        response.encoding = 'UTF-8'
+
+        if response.status_code != 200:
+            raise APIError(f"{method} {response.url} returned {response.status_code}", response.status_code)
+
+        return response.json()
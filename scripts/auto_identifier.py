@@ -1,137 +1,50 @@
+import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import storage
+import journal
+import synonyms
 import identifier #uses the identifier.py script for db function; could have used more common functions
-import pubchempy
+import pubchem_api
 import cas_api
-import json
+from work_queue import WorkQueue
+import api_cache
+import metrics
+from api_client import APIError
 
-def next_entry(cur, skip):
+def run_compound(entry_name, conn, cur, entry_ids=None):
     '''
-    Returns the next database entry that has not yet been identified and requires identification
+    Only automatic verification of compounds
+    Checks PubChem and CAS API to match name or IUPAC name (whichever available), if an exact match is found this is considered the correct compound
+    Results are stored for the given entry_ids, or for all entries with the same name
     '''
+    with metrics.timer('resolve_seconds'):
+        status, cas_find, pc_find = resolve_compound(entry_name)
 
-    # Because the skiplist has a variable length, the amount of variables to filter for should have a custom amount of '?' to use as placeholders
-    skipstring = ','.join(len(skip)*'?')
+        # Retrieve the PubChem synonyms and structure before storing, storing makes no requests
+        if pc_find:
+            pc_find.load_details()
 
-    # SQL to retrieve one database record that has no associated CAS or PubChem ID and does not occur on the skiplist
-    cur.execute('SELECT id, compound_name FROM Compound_entries WHERE (CAS_data_id IS NULL AND PC_data_id IS NULL) AND id NOT IN (%s)' % skipstring, skip)
-    return cur.fetchone()
-
-def add_pc_data(pc_data, conn, cur):
-    '''
-    Add pubchem data if this cid is not yet in the dataset
-    '''
+    # Store whatever was found, a failure has nothing to store
+    if status != "failure":
+        storage.store_data(entry_name, cas_find, pc_find, conn, cur, entry_ids)
 
-    # Creates dict version from the PubChemPy Compound object
-    pc_data = pc_data.to_dict()
-
-    # Check for existing records for this identifier in the database, a new record is only added if it does not exist yet.
-    cur.execute('SELECT * FROM PC_data WHERE cid = ?', (pc_data['cid'],))
-    results = cur.fetchall()
-
-    if not results:
-        # Create a tuple of the data to store in the correct order
-        write_data = (pc_data['cid'],
-                      str(pc_data['elements']),
-                      str(pc_data['atoms']),
-                      str(pc_data['bonds']),
-                      str(pc_data['molecular_formula']),
-                      pc_data['molecular_weight'],
-                      pc_data['canonical_smiles'],
-                      pc_data['isomeric_smiles'],
-                      pc_data['inchi'],
-                      pc_data['inchikey'],
-                      pc_data['iupac_name'],
-                      pc_data['xlogp'],
-                      pc_data['exact_mass'],
-                      pc_data['monoisotopic_mass'])
-
-        # create the actual record in the database
-        cur.execute('''INSERT INTO PC_data(cid,
-                                            elements,
-                                            atoms,
-                                            bonds,
-                                            molecular_formula,
-                                            molecular_weight,
-                                            canonical_smiles,
-                                            isometric_smiles,
-                                            inchi,
-                                            inchikey,
-                                            iupac_name,
-                                            xlogp,
-                                            exact_mass,
-                                            monoisotopic_mass)
-                                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', write_data)
-        conn.commit()
-
-def add_cas_data(cas_data, conn, cur):
-    '''
-    Adds cas data to the table if the CAS nr is not yet in the table
-    '''
+    return status
 
-    # Check for existing records for this identifier in the database, a new record is only added if it does not exist yet.
-    cur.execute('SELECT * from CAS_data WHERE cas_rn = ?', (cas_data['rn'],))
-    result = cur.fetchall()
-    
-    if not result:
-        # Create a tuple of the data to store in the correct order
-        data = (str(cas_data['rn']),
-                str(cas_data['uri']),
-                str(cas_data['name']),
-                str(cas_data['smile']),
-                str(cas_data['canonicalSmile']),
-                str(cas_data['inchi']),
-                str(cas_data['inchiKey']),
-                str(cas_data['molecularFormula']),
-                str(cas_data['molecularMass']),
-                str(cas_data['experimentalProperties']),
-                str(cas_data['propertyCitations']),
-                str(cas_data['synonyms']),
-                str(cas_data['replacedRns']))
-
-        # create the actual record in the database
-        cur.execute('''INSERT INTO CAS_data(cas_rn,
-                                            uri,
-                                            name,
-                                            smile,
-                                            canonical_smile,
-                                            inchi,
-                                            inchikey,
-                                            molecular_formula,
-                                            molecular_weight,
-                                            documented_properties,
-                                            sources,
-                                            synonyms,
-                                            replaced_cas)
-                                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)''',data)
-        conn.commit()
-    return True
-
-def store_data(entry_name, cas_find, pc_find, conn, cur):
+def resolve_compound(entry_name):
     '''
-    Stores the retrieve data from any of the API's in the database
-    '''
-    cas = None
-    pc = None
-    if cas_find:
-        add_cas_data(cas_find, conn, cur)
-        cas = cas_find['rn']
-    if pc_find:
-        add_pc_data(pc_find, conn, cur)
-        pc = pc_find.cid
-
-    cur.execute('UPDATE Compound_entries SET PC_data_id = ?, CAS_data_id = ? WHERE lower(compound_name) = ?', (pc, cas, entry_name.lower()))
-    conn.commit()
-        
-def run_compound(entry_name, conn, cur):
-    '''
-    Only automatic verification of compounds
-    Checks PubChem and CAS API to match name or IUPAC name (whichever available), if an exact match is found this is considered the correct compound
+    Network part of run_compound, does not touch the database so it can run on any thread.
+    Returns the status ("full", "partial" or "failure") together with the CAS and PubChem results that should be stored.
     '''
     # Retrieve first data due to incosistency in earlier version, should only affect retrieval of data.
     entry = entry_name
 
     # Retrieve data from both API's
-    pc_data = pubchempy.get_compounds(entry, 'name')
-    cas_data = json.loads(cas_api.search(entry))['results']
+    pc_data = pubchem_api.get_compounds(entry, 'name')
+    cas_data = cas_api.search(entry)['results']
 
     # Set flags for confirmed results to False
     pc_find = False
@@ -146,20 +59,23 @@ def run_compound(entry_name, conn, cur):
             print("Found CAS by name")
 
             # Set the found result to the result of the /details of the CAS api for this registration number
-            cas_find = cas_api.details(i['rn'])
+            # A registration number without details (removed from the register) can not be used
+            details = cas_api.details(i['rn'])
+            if not details:
+                continue
+            cas_find = details
 
             # Search the PubChem database using the InChI to match results
-            pc_result = pubchempy.get_compounds(cas_find['inchi'], 'inchi')
+            pc_result = pubchem_api.get_compounds(cas_find['inchi'], 'inchi')
             
             # InChI should only describe 1 compound, if it matches more then one this could indicate ambiguity
             if len(pc_result) == 1:
                 pc_find = pc_result[0]
-                print(f"PC {pc_find.to_dict()['cid']} found from inchi")
+                print(f"PC {pc_find.cid} found from inchi")
 
-    # Store results in database on automatch of both PubChem and CAS 
+    # Report back a match of both PubChem and CAS
     if cas_find and pc_find:
-        store_data(entry_name, cas_find, pc_find, conn, cur)
-        return "full"
+        return "full", cas_find, pc_find
 
     # PubChem Automatching
     # Its recommended to disable Pubchem matching due to problems described on GitHub.
@@ -171,74 +87,303 @@ def run_compound(entry_name, conn, cur):
     for i in pc_data:
         
         # Accept result on full IUPAC name match
-        if entry_name.lower() == i.to_dict()['iupac_name'].lower():
+        if i.iupac_name and entry_name.lower() == i.iupac_name.lower():
             pc_find = i
             
             # Search the CAS register for the InChI.
             # this statement might be the origin of the bug; a possible untested solution might be:
-            # cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchi'].replace("InChI=","")))['results']
+            # cas_result = cas_api.search(pc_find.inchi.replace("InChI=",""))['results']
             # fixing this bug is outside the scope of the project, but could be useful for future use of the script
-            cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchi']))['results']
+            cas_result = cas_api.search(pc_find.inchi)['results']
 
             # If a result was found throught CAS search, the chemical information is requested from the CAS API /details
             if cas_result:
-                cas_find = cas_api.details(cas_result[0]['rn'])
-                print(f"CAS {cas_find['rn']} found from inchi")
+                cas_find = cas_api.details(cas_result[0]['rn']) or False
+                if cas_find:
+                    print(f"CAS {cas_find['rn']} found from inchi")
 
     
                 
     if cas_find and pc_find:
-        store_data(entry_name, cas_find, pc_find, conn, cur)
-        return "full"
+        return "full", cas_find, pc_find
     
     # -- COMMENT OUT TO DISABLE PubChem Automatch [END]
 
     # Report back a partial find as partial
     if cas_find or pc_find:
-        store_data(entry_name, cas_find, pc_find, conn, cur)
-        return "partial"
+        return "partial", cas_find, pc_find
 
     # If no matches where found we report back a failure
-    return "failure"
+    return "failure", False, False
+
+class StoreWriter(threading.Thread):
+    '''
+    The only thread writing identification results to the database.
+    SQLite allows one writer at a time, so the resolving threads hand their results to this thread through a queue.
+    '''
+
+    def __init__(self, db_path:str = "dataset.db"):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.queue = queue.Queue()
+        self.error = None
+
+    def run(self):
+        # The connection is created here, SQLite connections can only be used on the thread that created them
+        conn, cur = identifier.db(self.db_path)
+        committer = storage.BatchCommitter(conn)
+
+        while True:
+            # Commit the last results when no new ones arrive for a while
+            try:
+                item = self.queue.get(timeout=committer.interval)
+            except queue.Empty:
+                committer.commit_due()
+                continue
+
+            # None signals that no more results will follow
+            if item is None:
+                break
+
+            # Keep draining the queue after an error so the resolving threads never block, but stop writing
+            if self.error:
+                continue
+
+            try:
+                with committer.compound():
+                    item(conn, cur)
+                committer.tick()
+            except Exception as error:
+                # Only the writes of the compound that failed are thrown away, the earlier ones are still committed
+                self.error = error
+
+        committer.flush()
+        conn.close()
+
+    def store(self, item, status, cas_find=False, pc_find=False, error=None):
+        '''
+        Queues the outcome of a work item for storing and journaling
+        '''
+        def write(conn, cur):
+            # The journal entry is committed together with the results, a name is either done completely or tried again
+            if status in ("full", "partial"):
+                storage.store_data(item['name'], cas_find, pc_find, conn, cur, item['ids'])
+            journal.record(cur, item, status, error)
+
+        self.queue.put(write)
+
+    def link(self, item, status, cas_rn, cid):
+        '''
+        Queues linking a work item to already stored records found in the synonym index
+        '''
+        def write(conn, cur):
+            storage.link_data(item['name'], cas_rn, cid, cur, item['ids'])
+            journal.record(cur, item, status)
+
+        self.queue.put(write)
+
+    def close(self):
+        '''
+        Waits until all queued results are written, raises the error that stopped the writer if there was one
+        '''
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+def resolve_safely(entry_name):
+    '''
+    resolve_compound for use on a worker thread, returns (status, cas_find, pc_find, error message).
+    An API that stays unavailable after retrying gives the status "error", these names are tried again by the next run.
+    Any other exception gives the status "error" as well, so the name is still journaled and counted instead of lost on the worker thread.
+    '''
+    try:
+        with metrics.timer('resolve_seconds'):
+            status, cas_find, pc_find = resolve_compound(entry_name)
+
+            # Retrieve the PubChem synonyms and structure here instead of on the writer thread
+            if pc_find:
+                pc_find.load_details()
+            return status, cas_find, pc_find, None
+    except APIError as error:
+        print(f"API error for {entry_name}: {error}")
+        return "error", False, False, str(error)
+    except Exception as error:
+        print(f"Error for {entry_name}: {error!r}")
+        return "error", False, False, repr(error)
+
+def prefetch_safely(names):
+    '''
+    Batches the PubChem name lookups for a group of names, failures are left for the lookups of the individual names
+    '''
+    try:
+        pubchem_api.prefetch(names)
+    except APIError as error:
+        print(f"API error while prefetching PubChem data: {error}")
+
+def run_concurrent(workers:int, db_path:str = "dataset.db", batch_size:int = pubchem_api.BATCH_SIZE, retry_older_than:float = None):
+    '''
+    Resolves all distinct unresolved compound names on a pool of worker threads.
+    The PubChem data of each batch of names is prefetched in a few multi-CID requests while the previous batch is being resolved.
+    The amount of simultaneous requests to each service is bounded by its client, results are stored by a single StoreWriter thread.
+    Names that failed in an earlier run are not tried again, unless they failed longer than retry_older_than seconds ago.
+    When storing fails no more names are resolved, the names that were not stored are tried again by the next run.
+    Returns the counts of full, partial and failed identifications.
+    '''
+    # Every normalized name is resolved once, the result is stored for all entries in its group
+    conn, cur = identifier.db(db_path)
+    print(f"Run journal: {journal.counts(cur)}")
+    work = WorkQueue(cur, exclude=journal.finished_keys(cur, retry_older_than))
+
+    writer = StoreWriter(db_path)
+    writer.start()
+
+    # A writer queue that keeps growing means SQLite can not keep up with the API's
+    metrics.gauge('writer_queue_depth', writer.queue.qsize)
+    metrics.gauge('work_remaining', lambda: work.remaining)
+
+    # Names submitted and not yet resolved, cancelled when the writer stops so no API requests are spent on results that would not be stored
+    futures = set()
+
+    def cancel_pending():
+        for future in list(futures):
+            future.cancel()
+
+    def finished(item, future):
+        # Runs on the worker thread as soon as a name is resolved
+        futures.discard(future)
+        if future.cancelled():
+            return
+        if writer.error:
+            cancel_pending()
+            return
+
+        status, cas_find, pc_find, error = future.result()
+        writer.store(item, status, cas_find, pc_find, error)
+
+        work.mark(item, status)
+        print(f"{item['name']} {status} tg={work.remaining}, {work.counts}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in work.batches(batch_size):
+                if writer.error:
+                    print(f"Storing failed, no more names are resolved: {writer.error!r}")
+                    cancel_pending()
+                    break
+
+                # Names of compounds that are already stored are resolved from the synonym index, without API requests.
+                # The index is read on this thread, the writer only links the entries
+                remote = []
+                for item in batch:
+                    cas_rn, cid = synonyms.lookup(cur, item['name'])
+                    if cas_rn is None and cid is None:
+                        remote.append(item)
+                        continue
+
+                    status = "full" if cas_rn is not None and cid is not None else "partial"
+                    writer.link(item, status, cas_rn, cid)
+                    work.mark(item, status)
+                    print(f"{item['name']} {status} (synonym index) tg={work.remaining}, {work.counts}")
+
+                prefetch_safely([item['name'] for item in remote])
+
+                for item in remote:
+                    future = pool.submit(resolve_safely, item['name'])
+                    futures.add(future)
+                    future.add_done_callback(partial(finished, item))
+    except BaseException:
+        # Wait for the writer, but do not let its error hide the one that stopped the run
+        try:
+            writer.close()
+        except Exception as error:
+            print(f"Storing failed as well: {error!r}")
+        raise
+    else:
+        # Raises the error that stopped the writer, if there was one
+        writer.close()
+    finally:
+        conn.close()
+        metrics.remove_gauge('writer_queue_depth')
+        metrics.remove_gauge('work_remaining')
+
+    return work.counts
+
+def print_cache_stats():
+    '''
+    Shows how many lookups were answered from the response cache
+    '''
+    for endpoint, stats in api_cache.get_cache().stats().items():
+        print(f"cache {endpoint}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Amount of compound names to resolve at the same time, 1 runs one name after the other")
+    parser.add_argument('--cas-concurrency', type=int, help="Maximum simultaneous requests to the CAS API")
+    parser.add_argument('--pubchem-concurrency', type=int, help="Maximum simultaneous requests to the PubChem API")
+    parser.add_argument('--structures', action='store_true', help="Also store PubChem elements, atoms and bonds (one extra request per stored compound)")
+    parser.add_argument('--metrics-file', help="Write a JSON snapshot of the run metrics to this file periodically")
+    parser.add_argument('--metrics-interval', type=float, default=30.0, help="Seconds between metrics snapshots")
+    parser.add_argument('--metrics-port', type=int, help="Serve the run metrics in Prometheus text format on this port (/metrics)")
+    parser.add_argument('--retry-failures-older-than', type=journal.parse_age, metavar="AGE",
+                        help="Try names that failed in an earlier run again when that was longer than AGE ago (e.g. 12h, 7d, 0 for all)")
+    args = parser.parse_args()
+
+    # Latency of every API call and database write, to tell whether a slow run was caused by the API's, SQLite or this script
+    exporter = metrics.Exporter(path=args.metrics_file, interval=args.metrics_interval, port=args.metrics_port).start()
+
+    pubchem_api.STRUCTURES = args.structures
+
+    if args.cas_concurrency:
+        cas_api.get_client().limit_concurrency(args.cas_concurrency)
+    if args.pubchem_concurrency:
+        pubchem_api.get_client().limit_concurrency(args.pubchem_concurrency)
+
+    # Concurrent mode, resolves many names at the same time
+    if args.workers > 1:
+        stats = run_concurrent(args.workers, retry_older_than=args.retry_failures_older_than)
+        print(f"Finished: {stats}")
+        print_cache_stats()
+        exporter.stop()
+        exit(0)
+
     # Setup database connection
     conn, cur = identifier.db()
 
-    # Create local skiplist
-    skiplist = []
+    # All distinct compound names that require identification, grouped by normalized name.
+    # Names that failed in earlier runs are in the run journal and are left out; the skiplist of the manual script is not used here
+    print(f"Run journal: {journal.counts(cur)}")
+    work = WorkQueue(cur, exclude=journal.finished_keys(cur, args.retry_failures_older_than))
+    metrics.gauge('work_remaining', lambda: work.remaining)
 
-    # Keep stats to show progress
-    partial_success = 0 # One API verified
-    full_success = 0 # Both APIs verified
-    failures = 0 # Neither API verified
-    
-    to_go = identifier.compounds_to_go(cur)
+    # Results are committed in batches, when stopped early (Ctrl+C) the pending results are still committed
+    committer = storage.BatchCommitter(conn)
 
     # Run until all compounds are processed
-    while True:
-        # Get next compound
-        entry_id, entry_name = next_entry(cur, skiplist)
-
-        # End if there are no more compounds
-        if not entry_name:
-            break
-
-        # Show stats
-        print(f"{entry_name} tg={identifier.compounds_to_go(cur)}, {partial_success=}, {full_success=}, {failures=}")
-
-        # Run identification steps
-        status = run_compound(entry_name, conn, cur)
-
-        # Update stats
-        match status:
-            case "full":
-                full_success += 1
-            case "partial":
-                partial_success += 1
-            case _:
-                failures += 1
-                skiplist.append(entry_id)
-                
-        # Update compounds to go
-        to_go = identifier.compounds_to_go(cur)
+    try:
+        for item in work:
+            entry_name = item['name']
+
+            # Show stats, counts are One API verified (partial), Both APIs verified (full) and Neither API verified (failure)
+            print(f"{entry_name} tg={work.remaining}, {work.counts}")
+
+            # Run identification steps, names of already stored compounds need no API requests.
+            # A service that stays unavailable after retrying is an error, these are tried again next run
+            # An error rolls back the writes this compound made so far, a half stored compound is never committed
+            error = None
+            try:
+                with committer.compound():
+                    status = identifier.run_local(entry_name, cur, item['ids']) or run_compound(entry_name, conn, cur, item['ids'])
+            except APIError as api_error:
+                print(f"API error for {entry_name}: {api_error}")
+                status, error = "error", str(api_error)
+
+            # Update stats, the journal entry is committed together with the stored results
+            journal.record(cur, item, status, error)
+            work.mark(item, status)
+            committer.tick()
+    finally:
+        committer.flush()
+        exporter.stop()
+
+    print_cache_stats()
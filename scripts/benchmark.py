@@ -0,0 +1,222 @@
+"""
+Benchmark of the compound identification pipeline.
+Runs auto_identifier over synthetic lists of compound names against fake_api.py in synthetic mode,
+on a temporary copy of the database, and writes the measurements as JSON so runs can be compared across changes.
+
+    python benchmark.py --sizes 1000 10000 --latency 0.05 --workers 8 --output benchmark.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import api_cache
+import auto_identifier
+import cas_api
+import identifier
+import pubchem_api
+import storage
+from fake_api import FakeAPI
+from work_queue import WorkQueue
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+class Timer:
+    '''
+    Adds up the time spent in a function
+    '''
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return timed
+
+
+@contextlib.contextmanager
+def timing(timer, owner, name):
+    '''
+    Times every call of owner.name while the context is active
+    '''
+    original = getattr(owner, name)
+    setattr(owner, name, timer.wrap(original))
+    try:
+        yield timer
+    finally:
+        setattr(owner, name, original)
+
+
+def synthetic_names(size:int, duplicates:float = 0.1):
+    '''
+    Returns `size` compound names, a fraction of them repeats an earlier name in another letter case
+    like the same compound reported in several papers
+    '''
+    distinct = max(1, int(size * (1 - duplicates)))
+    names = [f"synthetic compound {i}" for i in range(distinct)]
+    names += [names[i % distinct].upper() for i in range(size - distinct)]
+    return names
+
+
+def make_database(source:str, path:str, names):
+    '''
+    Copies the database and adds one experiment with an entry for every name
+    '''
+    shutil.copy(source, path)
+    conn = storage.connect(path)
+
+    experiment_id = conn.execute('SELECT id FROM Experiments ORDER BY id LIMIT 1').fetchone()
+    if experiment_id is None:
+        experiment_id = (conn.execute('INSERT INTO Experiments DEFAULT VALUES').lastrowid,)
+
+    conn.executemany('INSERT INTO Compound_entries(compound_name, experiment_id) VALUES (?,?)', [(name, experiment_id[0]) for name in names])
+    conn.commit()
+    conn.close()
+
+
+def run_serial(db_path:str):
+    '''
+    The single threaded loop of auto_identifier.py, returns the counts of full, partial and failed identifications
+    '''
+    conn, cur = identifier.db(db_path)
+    work = WorkQueue(cur)
+    committer = storage.BatchCommitter(conn)
+
+    try:
+        for item in work:
+            with committer.compound():
+                status = auto_identifier.run_compound(item['name'], conn, cur, item['ids'])
+            work.mark(item, status)
+            committer.tick()
+    finally:
+        committer.flush()
+        conn.close()
+
+    return work.counts
+
+
+def run_benchmark(size:int, args):
+    '''
+    Runs the pipeline for one list size and returns the measurements
+    '''
+    names = synthetic_names(size, args.duplicates)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        make_database(args.db, db_path, names)
+
+        # A fresh fake server and clients per run, so request counts and the synthetic registry start empty
+        fake = FakeAPI("synthetic", latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, miss_rate=args.miss_rate, seed=args.seed).start()
+        # A cold response cache like a normal run has, without one pubchem_api.prefetch can not keep the properties and every compound is fetched twice
+        cache = None
+        if not args.no_cache:
+            cache = api_cache.ResponseCache(os.path.join(directory, "cache.db"))
+
+        cas_api.set_client(cas_api.CASClient(fake.cas_url, rate=args.rate, burst=args.workers, concurrency=args.workers, cache=cache, backoff=0.01))
+        pubchem_api.set_client(pubchem_api.PubChemClient(fake.pubchem_url, rate=args.rate, burst=args.workers, concurrency=args.workers, cache=cache, backoff=0.01))
+
+        db_timer = Timer()
+        commit_timer = Timer()
+
+        # The identification scripts print a line per compound, keep those out of the benchmark output
+        output = None if args.verbose else open(os.devnull, 'w')
+        quiet = contextlib.redirect_stdout(output) if output else contextlib.nullcontext()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with timing(db_timer, storage, 'store_data'), timing(commit_timer, storage.BatchCommitter, 'flush'), quiet:
+                if args.workers > 1:
+                    counts = auto_identifier.run_concurrent(args.workers, db_path)
+                else:
+                    counts = run_serial(db_path)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            fake.stop()
+            if output:
+                output.close()
+            if cache:
+                cache.close()
+
+    resolved = counts.get('full', 0) + counts.get('partial', 0)
+    processed = sum(counts.values())
+    api_calls = sum(fake.counts.values())
+
+    return {'size': size,
+            'distinct_names': processed,
+            'workers': args.workers,
+            'cache': not args.no_cache,
+            'seconds': round(elapsed, 3),
+            'names_per_second': round(size / elapsed, 2),
+            'distinct_names_per_second': round(processed / elapsed, 2),
+            'counts': counts,
+            'api_calls': api_calls,
+            'api_calls_per_endpoint': dict(sorted(fake.counts.items())),
+            'api_calls_per_resolved_compound': round(api_calls / resolved, 3) if resolved else None,
+            'db_seconds': round(db_timer.seconds + commit_timer.seconds, 3),
+            'db_ms_per_compound': round((db_timer.seconds + commit_timer.seconds) / processed * 1000, 3) if processed else None,
+            'commits': commit_timer.calls,
+            'peak_memory_mb': round(peak_memory / 1024 / 1024, 2)}
+
+
+def git_revision():
+    '''
+    Returns the current git commit, to tell which version of the code a result file belongs to
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Amounts of compound names to benchmark")
+    parser.add_argument('--workers', type=int, default=8, help="Worker threads of auto_identifier, 1 benchmarks the serial loop")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the fake API's wait before every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra latency, up to this value")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 503 error")
+    parser.add_argument('--miss-rate', type=float, default=0.1, help="Fraction of names unknown to both services")
+    parser.add_argument('--duplicates', type=float, default=0.1, help="Fraction of entries repeating an earlier name")
+    parser.add_argument('--rate', type=float, default=1000.0, help="Request rate limit of the clients, the real services allow far less")
+    parser.add_argument('--no-cache', action='store_true', help="Run without the (cold) response cache a normal run uses")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', default="../dataset.db", help="Database to copy for every run")
+    parser.add_argument('--output', default="benchmark.json")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show the output of the identification scripts")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = run_benchmark(size, args)
+        results.append(result)
+        print(f"{size} names: {result['names_per_second']} names/s, {result['api_calls_per_resolved_compound']} API calls per resolved compound, "
+              f"{result['db_ms_per_compound']} ms database time per compound, {result['peak_memory_mb']} MB peak memory")
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'verbose')}
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'revision': git_revision(),
+              'python': platform.python_version(),
+              'settings': settings,
+              'results': results}
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
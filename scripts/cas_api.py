@@ -1,38 +1,176 @@
-import requests
 import argparse
 import json
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import api_cache
+from api_client import APIClient, APIError
+
+# Common Chemistry asks clients to keep the request rate low, these defaults stay well below that
+# The PYRODB_CAS_URL environment variable points the scripts at another server, for example fake_api.py
+CAS_API_URL = "https://commonchemistry.cas.org/api"
+CAS_BASE_URL = os.environ.get("PYRODB_CAS_URL", CAS_API_URL)
+CAS_RATE = 2.0 # requests per second
+CAS_CONCURRENCY = 2 # requests in flight at the same time
+CAS_BURST = 4
+
+# Queries resolved at the same time in batch mode, the client still limits the requests in flight and their rate
+BATCH_WORKERS = 4
+
+
+class CASClient(APIClient):
+    '''
+    Client for the CAS Common Chemistry API, reuses one keep-alive connection for all requests
+    '''
+
+    def __init__(self, base_url:str = CAS_BASE_URL, rate:float = CAS_RATE, burst:int = CAS_BURST,
+                 concurrency:int = CAS_CONCURRENCY, cache=None, **kwargs):
+        super().__init__(base_url, rate=rate, burst=burst, concurrency=concurrency, **kwargs)
+
+        # Optional api_cache.ResponseCache, when given responses are served from it whenever possible
+        self.cache = cache
+
+    def search(self, query):
+        '''Search cas library by Cas Nr. Smiles, InChl(without prefix), InChlKey or name'''
+        if self.cache is not None:
+            return self.cache.cached('cas_search', query, self.fetch_search, empty=lambda result: not result['results'])
+        return self.fetch_search(query)
+
+    def details(self, query):
+        ''' Returns details of a chemcal by cas number, or None if the number is unknown '''
+        if self.cache is not None:
+            return self.cache.cached('cas_detail', query, self.fetch_details)
+        return self.fetch_details(query)
+
+    def fetch_search(self, query):
+        '''
+        Requests search results from the API
+        '''
+        return self.get_json('search', params={'q': query}, endpoint='cas_search')
+
+    def fetch_details(self, query):
+        '''
+        Requests the details of a registration number from the API
+        '''
+        try:
+            return self.get_json('detail', params={'cas_rn': query}, endpoint='cas_detail')
+        except APIError as error:
+            # An unknown (or mistyped) registration number is not an error, there simply are no details
+            if error.status_code == 404:
+                return None
+            raise
+
+
+# One client is shared by all callers of the module level functions so they share connections and the rate limit
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''
+    Returns the shared CAS client, creating it on first use
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = CASClient(cache=api_cache.get_cache())
+    return _client
+
+def set_client(client):
+    '''
+    Replaces the shared CAS client, for example with one pointing at another server or using other limits
+    '''
+    global _client
+    with _client_lock:
+        _client = client
 
 def search(query):
     '''Search cas library by Cas Nr. Smiles, InChl(without prefix), InChlKey or name'''
-    base_url = "https://commonchemistry.cas.org/api/search"
-    full_url = f'{base_url}?q={query}'
-    result = requests.get(full_url)
-    if result.status_code == 200:
-        return result.text
-    print(result.status_code)
+    return get_client().search(query)
 
 def details(query):
     ''' Returns details of a chemcal by cas number '''
-    base_url = "https://commonchemistry.cas.org/api/detail"
-    full_url = f'{base_url}?cas_rn={query}'
-    result = requests.get(full_url)
-    result.encoding = 'UTF-8'
-    if result.status_code == 200:
-        return json.loads(result.text)
-    print(result.status_code)
+    return get_client().details(query)
+
+def read_queries(file):
+    '''
+    Yields the queries of a batch file, one name, CAS number, InChI or InChIKey per line. Empty lines are skipped
+    '''
+    for line in file:
+        query = line.strip()
+        if query:
+            yield query
+
+def lookup(query:str, with_details:bool = False):
+    '''
+    Searches one query of a batch, optionally with the details of every search result.
+    Returns a dict that can be written as a line of JSON, a failed request gives an 'error' instead of results
+    '''
+    try:
+        result = {'query': query, 'results': search(query)['results']}
+        if with_details:
+            # The image is a large SVG that is of no use outside of a browser
+            result['details'] = [{key: value for key, value in (details(hit['rn']) or {}).items() if key != "image"}
+                                 for hit in result['results']]
+    except APIError as error:
+        result = {'query': query, 'error': str(error)}
+    return result
+
+def run_batch(queries, output, workers:int = BATCH_WORKERS, with_details:bool = False):
+    '''
+    Resolves the queries concurrently and writes every result as one line of JSON to output as soon as it is complete,
+    so results appear in the order they finish instead of the order of the queries.
+    Only a limited amount of queries is read ahead, so the input can be of any size.
+    Returns the amount of queries and the amount of failed queries
+    '''
+    queries = iter(queries)
+    counts = {'queries': 0, 'errors': 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            # Keep every worker busy with one query and one waiting
+            while len(pending) < 2 * workers:
+                query = next(queries, None)
+                if query is None:
+                    break
+                pending.add(pool.submit(lookup, query, with_details))
+
+            if not pending:
+                return counts
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                counts['queries'] += 1
+                counts['errors'] += 'error' in result
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--search', type=str, help="Name or cas nr. of a chemical to search for")
+    parser.add_argument('--batch', metavar='FILE', help="Search every line of a file ('-' reads stdin) and write the results to stdout as JSON lines")
+    parser.add_argument('--details', action='store_true', help="In batch mode also retrieve the details of every search result")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help="Queries resolved at the same time in batch mode")
     args = parser.parse_args()
 
+    if args.batch:
+        with (sys.stdin if args.batch == "-" else open(args.batch, encoding='utf-8')) as file:
+            counts = run_batch(read_queries(file), sys.stdout, args.workers, args.details)
+
+        # The summary goes to stderr, so stdout only holds the results
+        print(f"Resolved {counts['queries']} queries, {counts['errors']} failed", file=sys.stderr)
+        exit(0)
+
     query = args.search
 
     if not args.search:
         print('Please enter the name of the chemical you would like to search')
         query = input('>')
 
-    search_result = json.loads(search(query))['results']
+    search_result = search(query)['results']
    
     for index, result in enumerate(search_result):
         print(f"{index+1:4d}: {result['name']:20s} - {result['rn']}")
@@ -0,0 +1,89 @@
+"""
+Storage of the list fields of CAS records as JSON, and of their experimental properties in the "CAS_properties" table,
+one row per property with its numerical value and unit so properties can be selected with a single indexed query:
+    SELECT cas_rn, value FROM CAS_properties WHERE name = 'Boiling Point' AND unit = '°C'
+"""
+import ast
+import json
+import re
+
+# CAS_data columns holding lists from the CAS details, with the key in the CAS API response
+JSON_COLUMNS = {'documented_properties': 'experimentalProperties',
+                'sources': 'propertyCitations',
+                'synonyms': 'synonyms',
+                'replaced_cas': 'replacedRns'}
+
+# Property values look like "78.2 °C", "-114.1 °C", "217-218 °C @ Press: 760 Torr" or "0.789 g/cm<sup>3</sup> @ Temp: 20 °C"
+NUMBER = re.compile(r"^\s*([-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)")
+HTML_TAG = re.compile(r"<[^>]+>")
+
+def to_json(value):
+    '''
+    JSON text for a list from the CAS API, None stays None
+    '''
+    return json.dumps(value, ensure_ascii=False) if value is not None else None
+
+def load_list(value):
+    '''
+    Reads a stored list field, stored as JSON or as the Python representation written by older versions of the scripts
+    '''
+    if value is None or value == "None":
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+def parse_property(text:str):
+    '''
+    Splits a CAS property value into (value, unit).
+    value is the first number (the lower bound for ranges like "217-218 °C"), None when the text does not start with a number.
+    unit is the text after the number up to the conditions ("@ ..."), without HTML markup.
+    '''
+    text = HTML_TAG.sub("", text or "")
+    match = NUMBER.match(text)
+    if not match:
+        return None, None
+
+    rest = text[match.end():].split("@")[0]
+
+    # Skip the upper bound of a range
+    rest = re.sub(r"^\s*-\s*[-+]?\d+(?:\.\d*)?", "", rest)
+    return float(match.group(1)), rest.strip() or None
+
+def add_properties(cur, cas_rn, experimental_properties):
+    '''
+    Stores the experimental properties of a CAS record in the CAS_properties table, replacing earlier rows for this CAS number
+    Does not commit
+    '''
+    cur.execute('DELETE FROM CAS_properties WHERE cas_rn = ?', (cas_rn,))
+
+    rows = []
+    for prop in experimental_properties or []:
+        value, unit = parse_property(prop.get('property'))
+        rows.append((cas_rn, prop.get('name'), value, unit, prop.get('property'), prop.get('sourceNumber')))
+
+    cur.executemany('INSERT INTO CAS_properties(cas_rn, name, value, unit, raw, source_number) VALUES (?,?,?,?,?,?)', rows)
+
+def convert(conn):
+    '''
+    Rewrites the list fields of all stored CAS records as JSON and fills CAS_properties, used by the schema migration
+    '''
+    cur = conn.cursor()
+    columns = list(JSON_COLUMNS)
+
+    for row in conn.execute(f'SELECT cas_rn, {", ".join(columns)} FROM CAS_data').fetchall():
+        cas_rn, stored = row[0], row[1:]
+
+        values = []
+        for value in stored:
+            try:
+                values.append(to_json(load_list(value)))
+            except (ValueError, SyntaxError):
+                # Leave values that can not be read as they are instead of losing them
+                values.append(value)
+
+        cur.execute(f'UPDATE CAS_data SET {", ".join(f"{column} = ?" for column in columns)} WHERE cas_rn = ?', values + [cas_rn])
+
+        properties = values[columns.index('documented_properties')]
+        add_properties(cur, cas_rn, json.loads(properties) if properties and properties.startswith('[') else [])
@@ -1,26 +1,161 @@
-"""Inserts compounds and related experiment ID from a text file into a database file."""
-import sqlite3
+"""Inserts compounds and related experiment ID from text files (tab separated or CSV) into a database file.
+Files are read line by line so they can be of any size, rows are inserted in chunks of one transaction each.
+Rows with an unknown experiment ID or that can not be read are written to a file of rejected rows,
+rows that are already in the database for the same experiment are skipped."""
+import argparse
+import csv
+import io
+import re
+import sys
+import time
 
-if __name__ == "__main__":
-    # Opens textfile containing [compound_name][tab][experiment_id] formatted data
-    with open("compound_entries.txt") as file:
-        entries = file.read().splitlines()
+import storage
 
-    # Creates a database connection
-    conn = sqlite3.connect("dataset.db")
+# Rows inserted per transaction
+CHUNK_SIZE = 10000
+
+# Excel adds a byte order mark to UTF-8 exports, which is removed by this encoding
+ENCODING = "utf-8-sig"
+
+# Bytes that can not be decoded are kept as these surrogate characters (errors='surrogateescape'), rows containing them are rejected
+UNDECODABLE = re.compile("[\udc80-\udcff]")
+
+def open_input(path:str, encoding:str = ENCODING):
+    '''
+    Opens an input file, '-' reads from stdin.
+    Bytes that are not valid in the encoding do not stop the import, the lines containing them are rejected by validate
+    '''
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, errors='surrogateescape', newline='')
+    return open(path, newline='', encoding=encoding, errors='surrogateescape')
+
+def delimiter_for(path:str, delimiter=None):
+    '''
+    The column separator of a file: given explicitly, or a comma for .csv files and a tab for everything else
+    '''
+    if delimiter:
+        return delimiter
+    return "," if path.lower().endswith(".csv") else "\t"
+
+def read_rows(file, delimiter:str):
+    '''
+    Yields (line number, fields or None, error) for every line of a file, a line that can not be parsed gives its error
+    Tab separated files are read without quoting, quotes are part of the names there and an unbalanced quote can not swallow the following lines
+    '''
+    reader = csv.reader(file, delimiter=delimiter, quoting=csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL)
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield reader.line_num, None, str(error)
+            continue
+        yield reader.line_num, fields, None
+
+def validate(fields, experiments):
+    '''
+    Returns (compound name, experiment id) for a valid row, or raises ValueError with the reason the row is rejected
+    '''
+    # Trailing empty columns are left behind by spreadsheet exports
+    while fields and not fields[-1].strip():
+        fields = fields[:-1]
+
+    if len(fields) != 2:
+        raise ValueError(f"expected 2 columns, found {len(fields)}")
+    if any(UNDECODABLE.search(field) for field in fields):
+        raise ValueError("contains characters that can not be decoded, see --encoding")
+
+    # Whitespace characters might be artifacts from the importing process
+    name, experiment_id = fields[0].strip(), fields[1].strip()
+
+    if not name:
+        raise ValueError("empty compound name")
+    if not experiment_id.isdigit():
+        raise ValueError(f"experiment id '{experiment_id}' is not a number")
+    if int(experiment_id) not in experiments:
+        raise ValueError(f"experiment id {experiment_id} does not exist")
+
+    return name, int(experiment_id)
+
+def load(paths, conn, rejected, delimiter=None, chunk_size:int = CHUNK_SIZE, header:bool = False, encoding:str = ENCODING):
+    '''
+    Inserts the rows of all files, a row is only inserted when the same name is not yet in the database for that experiment.
+    Rejected rows are written to the csv writer `rejected` with their file, line number and reason.
+    Returns counts of read, inserted, duplicate and rejected rows.
+    '''
     cur = conn.cursor()
+    counts = {'read': 0, 'inserted': 0, 'duplicate': 0, 'rejected': 0}
+
+    # All experiment ids are read once instead of checking every row against the table
+    experiments = {experiment_id for experiment_id, in cur.execute('SELECT id FROM Experiments')}
+
+    # Valid rows waiting to be inserted
+    chunk = []
+
+    def insert(chunk):
+        # Insert if absent, uses the Compound_entries_name_experiment index. Rows earlier in the same chunk count as present as well
+        cur.executemany('''INSERT INTO Compound_entries(compound_name, experiment_id)
+                           SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM Compound_entries WHERE compound_name = ? AND experiment_id = ?)''',
+                        [(name, experiment_id, name, experiment_id) for name, experiment_id in chunk])
+        counts['inserted'] += cur.rowcount
+        counts['duplicate'] += len(chunk) - cur.rowcount
+
+        # Every chunk is its own transaction, a failure only loses the current chunk
+        conn.commit()
+
+    for path in paths:
+        with open_input(path, encoding) as file:
+            for line_number, fields, error in read_rows(file, delimiter_for(path, delimiter)):
+                if header and line_number == 1:
+                    continue
+                if fields == []:
+                    continue
+                counts['read'] += 1
 
-    # Sets up a list of data to insert
-    to_insert = []
+                try:
+                    if error:
+                        raise ValueError(error)
+                    name, experiment_id = validate(fields, experiments)
+                except ValueError as reason:
+                    counts['rejected'] += 1
+                    rejected.writerow([path, line_number, str(reason)] + (fields or []))
+                    continue
 
-    for entry in entries:
-        # Split line on tab giving a compound name at index 0 and an experiment id at index 1
-        entry = entry.split("\t")
+                chunk.append((name, experiment_id))
+                if len(chunk) >= chunk_size:
+                    insert(chunk)
+                    chunk = []
 
-        # Tuples of data are prepared by removing any whitespace characters that might be artifacts from the importing process
-        to_insert.append((entry[0].strip(),entry[1].strip()))
+    insert(chunk)
+    return counts
 
-    # Insert all into the the database, then commit the changes and close the connection
-    cur.executemany("INSERT INTO Compound_entries(compound_name, experiment_id) VALUES (?, ?)",to_insert)
-    conn.commit()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', default=["compound_entries.txt"],
+                        help="Files with [compound_name][tab][experiment_id] lines (or comma separated for .csv files), '-' reads stdin")
+    parser.add_argument('--db', default="dataset.db")
+    parser.add_argument('--delimiter', help="Column separator, by default a comma for .csv files and a tab otherwise")
+    parser.add_argument('--header', action='store_true', help="Skip the first line of every file")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows inserted per transaction")
+    parser.add_argument('--rejected', default="rejected_rows.tsv", help="File the rejected rows are written to")
+    parser.add_argument('--encoding', default=ENCODING, help="Encoding of the input files, for example cp1252 for older Excel exports")
+    args = parser.parse_args()
+
+    # Creates a database connection
+    conn = storage.connect(args.db)
+
+    start = time.perf_counter()
+    # Undecodable bytes of rejected rows are written as escapes
+    with open(args.rejected, 'w', newline='', encoding='utf-8', errors='backslashreplace') as rejected_file:
+        rejected = csv.writer(rejected_file, delimiter="\t")
+        rejected.writerow(["file", "line", "reason", "row"])
+        counts = load(args.files, conn, rejected, args.delimiter, args.chunk_size, args.header, args.encoding)
+    seconds = time.perf_counter() - start
     conn.close()
+
+    # Summary of the import
+    print(f"Read {counts['read']} rows in {seconds:.1f} s ({counts['read'] / seconds:.0f} rows/s)")
+    print(f"Inserted {counts['inserted']}, skipped {counts['duplicate']} already present, rejected {counts['rejected']}")
+    if counts['rejected']:
+        print(f"Rejected rows were written to {args.rejected}")
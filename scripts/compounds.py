@@ -0,0 +1,60 @@
+"""
+Registry of distinct compounds, the "Compounds" table of dataset.db.
+Every compound has an integer id and a unique InChIKey. CAS_data, PC_data, Compound_entries and Ecotoxicity reference it
+through their compound_id column, so finding the unique compounds (for example in episuite_input.py) is a short integer join.
+"""
+
+def normalize_inchikey(inchikey):
+    '''
+    The bare InChIKey: CAS prefixes it with "InChIKey=" and records without one are stored as "None"
+    '''
+    if inchikey is None:
+        return None
+    inchikey = str(inchikey).strip()
+    if inchikey.startswith("InChIKey="):
+        inchikey = inchikey[len("InChIKey="):]
+    return inchikey if inchikey and inchikey != "None" else None
+
+def register(cur, inchikey, inchi):
+    '''
+    Returns the id of the compound with this InChIKey, the compound is added when it is not yet known.
+    Returns None for records without an InChIKey
+    Does not commit
+    '''
+    inchikey = normalize_inchikey(inchikey)
+    if inchikey is None:
+        return None
+
+    cur.execute('INSERT OR IGNORE INTO Compounds(inchikey, inchi) VALUES (?,?)', (inchikey, inchi if inchi and inchi != "None" else None))
+    cur.execute('SELECT id FROM Compounds WHERE inchikey = ?', (inchikey,))
+    return cur.fetchone()[0]
+
+def link_entries(cur):
+    '''
+    Sets the compound of the identified entries to the compound of their CAS record, or of their PubChem record without a CAS record
+    Does not commit
+    '''
+    cur.execute('''UPDATE Compound_entries
+                   SET compound_id = COALESCE((SELECT compound_id FROM CAS_data WHERE cas_rn = Compound_entries.CAS_data_id),
+                                              (SELECT compound_id FROM PC_data WHERE cid = Compound_entries.PC_data_id))
+                   WHERE CAS_data_id IS NOT NULL OR PC_data_id IS NOT NULL''')
+
+def backfill(conn):
+    '''
+    Registers the compounds of all stored CAS and PubChem records and links all tables to them, used by the schema migration
+    '''
+    cur = conn.cursor()
+
+    for cas_rn, inchikey, inchi in conn.execute('SELECT cas_rn, inchikey, inchi FROM CAS_data').fetchall():
+        cur.execute('UPDATE CAS_data SET compound_id = ? WHERE cas_rn = ?', (register(cur, inchikey, inchi), cas_rn))
+
+    for cid, inchikey, inchi in conn.execute('SELECT cid, inchikey, inchi FROM PC_data').fetchall():
+        cur.execute('UPDATE PC_data SET compound_id = ? WHERE cid = ?', (register(cur, inchikey, inchi), cid))
+
+    link_entries(cur)
+
+    # Assessments only have the InChI written to the EPI Suite translation file, which is the InChI of the CAS or PubChem record
+    cur.execute('''UPDATE Ecotoxicity
+                   SET compound_id = COALESCE((SELECT id FROM Compounds WHERE inchi = Ecotoxicity.inchi),
+                                              (SELECT compound_id FROM CAS_data WHERE inchi = Ecotoxicity.inchi),
+                                              (SELECT compound_id FROM PC_data WHERE inchi = Ecotoxicity.inchi))''')
@@ -1,7 +1,25 @@
-import re
-import sqlite3
+import argparse
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from identifier import db
 
+# The outputs of the compounds in a FULL output file are separated by this line, with two empty lines on both sides
+SEPARATOR = '''
+
+
+========================
+
+
+'''
+
+# EPI suite is a Windows program writing ANSI text, latin-1 can decode every byte so reading never fails
+ENCODING = "latin-1"
+
+# Size of the parts of an output file extracted by one worker process when using more than one process
+SHARD_SIZE = 8 * 1024 * 1024 # bytes
+
 def result_to_float(result):
     ''' Returns a float value if a given value is not empty, if it is empty it returns a float zero'''
 
@@ -11,193 +29,296 @@ def result_to_float(result):
     else:
         return float(result)
 
-def extract_epi_summary(raw_data):
+def find_separator(data, encoding:str = ENCODING):
     '''
-    Extract Summary from EPI suite output file
+    The separator as bytes of a memory mapped output file, it needs the line endings used in the file
     '''
+    first_newline = data.find(b"\n")
+    newline = b"\r\n" if first_newline > 0 and data[first_newline - 1:first_newline] == b"\r" else b"\n"
+    return SEPARATOR.encode(encoding).replace(b"\n", newline)
 
-    # Isolate the summary from raw_data
-    pattern = re.compile(r"-{30} EPI SUMMARY.*-{26}(.*?    Melting Point \(deg C\)  :   .*?\n)", re.DOTALL)
-    data = pattern.search(raw_data).group(0)
-
-    # Setting up patterns
-    solubility_pattern = re.compile(r"    Water Solubility \(mg/L\):   (.*?)\n", re.DOTALL)
-    vapor_pattern = re.compile(r"    Vapor Pressure \(mm Hg\) :   (.*?)\n", re.DOTALL)
-    henry_pattern = re.compile(r"    Henry LC \(atm-m3/mole\) :   (.*?)\n", re.DOTALL)
-    kow_pattern = re.compile(r"    Log Kow \(octanol-water\):   (.*?)\n", re.DOTALL)
-    boiling_pattern = re.compile(r"    Boiling Point \(deg C\)  :   (.*?)\n", re.DOTALL)
-    melting_pattern = re.compile(r"    Melting Point \(deg C\)  :   (.*?)\n", re.DOTALL)
-
-    # extracting data using patterns
-    processed = {}
-    processed['solubility'] = result_to_float(solubility_pattern.search(raw_data).group(1))
-    processed['vapor'] = result_to_float(vapor_pattern.search(raw_data).group(1))
-    processed['henry'] = result_to_float(henry_pattern.search(raw_data).group(1))
-    processed['kow'] = result_to_float(kow_pattern.search(raw_data).group(1))
-    processed['boiling'] = result_to_float(boiling_pattern.search(raw_data).group(1))
-    processed['melting'] = result_to_float(melting_pattern.search(raw_data).group(1))
-
-    return processed
-
-def split_compounds(raw_data):
+def read_compounds(infile, encoding:str = ENCODING, start:int = 0, end=None):
     '''
-    Splits EPI suite output data into the model outputs per compound.
-    Returns a list of individual compound outputs.
+    Yields the model outputs of each compound in an EPI suite output file, the parts between the separators.
+    The file is memory mapped and only the output of one compound is decoded at a time,
+    so the memory use stays the same no matter how large the output file is.
+    Windows line endings are converted like reading the file in text mode does.
+    start and end limit reading to a part of the file (in bytes), see shard_file
     '''
-    compounds = raw_data.split('''
-
+    with open(infile, 'rb') as f:
+        # An empty file can not be memory mapped, and holds no compounds
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            separator = find_separator(data, encoding)
+            end = len(data) if end is None else end
+
+            while True:
+                stop = data.find(separator, start, end)
+                if stop == -1:
+                    # A part of the file ends right after a separator, only the end of the file can hold an empty last output
+                    if start < end or end == len(data):
+                        yield data[start:end].decode(encoding).replace("\r\n", "\n").replace("\r", "\n")
+                    return
+
+                yield data[start:stop].decode(encoding).replace("\r\n", "\n").replace("\r", "\n")
+                start = stop + len(separator)
+
+def shard_file(infile, shards:int, encoding:str = ENCODING):
+    '''
+    Divides an output file in about equally large parts of whole compounds, returns (start, end) byte offsets for read_compounds
+    '''
+    with open(infile, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or shards <= 1:
+            return [(0, size)]
 
-========================
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            separator = find_separator(data, encoding)
 
+            # Every part starts right after the first separator following an equal division of the file
+            starts = [0]
+            for number in range(1, shards):
+                position = data.find(separator, max(starts[-1], size * number // shards))
+                if position == -1 or position + len(separator) >= size:
+                    break
+                starts.append(position + len(separator))
 
-''')
-    return compounds
+    return list(zip(starts, starts[1:] + [size]))
 
-def extract_ecosar(raw_data):
+def scan_shard(infile, start:int, end:int, encoding:str = ENCODING):
     '''
-    Extracts Ecosar model data from EPI suite output file
+    Extracts the results of all compounds in a part of an output file, runs in a worker process of parse_compounds
     '''
+    return [scan_compound(raw_data) for raw_data in read_compounds(infile, encoding, start, end)]
 
-    # Retrieve ECOSAR version info
-    pattern = re.compile(r"ECOSAR Version(.*?)Note:.*?\n", re.DOTALL)
-    data = pattern.search(raw_data).group(0)
-
-    # Base parameter patterns
-    smiles_pattern = re.compile(r"SMILES : (.*?)\n", re.DOTALL)
-    chem_pattern = re.compile(r"CHEM   : (.*?)\n", re.DOTALL)
-    cas_pattern = re.compile(r"CAS Num: (.*?)\n", re.DOTALL)
-    chemid_pattern = re.compile(r"ChemID1: (.*?)\n", re.DOTALL)
-    molfor_pattern = re.compile(r"MOL FOR: (.*?)\n", re.DOTALL)
-    molwt_pattern = re.compile(r"MOL WT : (.*?)\n", re.DOTALL)
-
-    # Used parameters patterns
-    modelparams_pattern = re.compile(r"Values used to Generate(.*)\n\n\n", re.DOTALL)
-    modelparams = modelparams_pattern.search(data).group(0)
-    kow_pattern = re.compile(r"Log Kow: (.*?) .*?\((.*?)\)\n", re.DOTALL)
-    solubility_pattern = re.compile(r"Wat Sol: (.*?) .*?\((.*?)\)\n", re.DOTALL)
+def parse_compounds(infile, processes:int = 1, encoding:str = ENCODING):
+    '''
+    Yields the extracted results (see scan_compound) of every compound in an output file, in the order of the file.
+    With more than one process the file is divided in parts of whole compounds which are extracted in parallel,
+    the results are still yielded in the order of the file so they are the same as when extracting in one process.
+    '''
+    if processes <= 1:
+        for raw_data in read_compounds(infile, encoding):
+            yield scan_compound(raw_data)
+        return
+
+    # Parts of about SHARD_SIZE bytes, at least one for every process
+    shards = shard_file(infile, max(processes, os.path.getsize(infile) // SHARD_SIZE), encoding)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # Only a few parts per process are in progress at a time, so the results held in memory stay limited
+        pending = deque()
+        shards = iter(shards)
+        while True:
+            while len(pending) < 2 * processes:
+                shard = next(shards, None)
+                if shard is None:
+                    break
+                pending.append(pool.submit(scan_shard, infile, shard[0], shard[1], encoding))
+
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+def parse_ecosar_test(test):
+    '''
+    Reads one line of the table of simulated animal tests of ECOSAR, returns None for lines that are not a test result
+    '''
+    try:
+        # The tests are listed in a table format, cells in this table are devided using multiple spaces
+        splittest = test.split('   ')
+
+        # Cleaning up of extra spaces and other information
+        parts_list = []
+        for part in splittest:
+            cleaned_part = part.replace(":","")
+            cleaned_part = cleaned_part.strip()
+            if len(cleaned_part) > 0:
+                parts_list.append(cleaned_part)
+
+        # Required information is extracted from the cleaned table
+        test_results = {}
+        test_results['ecosar_class'] = parts_list[0]
+        test_results['organism'] = parts_list[1]
+        test_results['duration'] = parts_list[2]
+        test_results['endpoint'] = parts_list[3]
+
+        # Sometimes asterixes are used to provide a note about solubility being to low to express the predicted effects in real tests.
+        # This information is extracted, but not used further in the PyroDB project.
+        if '*' in parts_list[4]:
+            test_results['solubility_error'] = True
+
+        # The asterix is cleaned off when it was present after flagging its existence
+        test_results['predicted_conc'] = result_to_float(parts_list[4].replace(" *",""))
+
+        # results are stored
+        return test_results
+    except:
+        return None
+
+SUMMARY_LABELS = {"    Water Solubility (mg/L):   ": 'solubility',
+                  "    Vapor Pressure (mm Hg) :   ": 'vapor',
+                  "    Henry LC (atm-m3/mole) :   ": 'henry',
+                  "    Log Kow (octanol-water):   ": 'kow',
+                  "    Boiling Point (deg C)  :   ": 'boiling',
+                  "    Melting Point (deg C)  :   ": 'melting'}
+
+ECOSAR_LABELS = {"SMILES : ": 'SMILES',
+                 "CHEM   : ": 'CHEM',
+                 "CAS Num: ": 'CAS',
+                 "ChemID1: ": 'ChemID',
+                 "MOL FOR: ": 'mol_for',
+                 "MOL WT : ": 'mol_weight'}
+
+ECOSAR_PARAMETER_LABELS = {"Log Kow: ": 'kow',
+                           "Wat Sol: ": 'solubility'}
+
+BIOWIN_LABELS = {"Biowin1 (Linear Model Prediction)    :  ": '1',
+                 "Biowin2 (Non-Linear Model Prediction):  ": '2',
+                 "Biowin3 (Ultimate Biodegradation Timeframe):  ": '3',
+                 "Biowin4 (Primary  Biodegradation Timeframe):  ": '4',
+                 "Biowin5 (MITI Linear Model Prediction)    :  ": '5',
+                 "Biowin6 (MITI Non-Linear Model Prediction):  ": '6',
+                 "Biowin7 (Anaerobic Model Prediction):  ": '7',
+                 "Ready Biodegradability Prediction:  ": 'ready'}
+
+BCFBAF_LABELS = {"Log BCF (regression-based estimate):": 'bcf',
+                 "Log BAF (Arnot-Gobas upper trophic):": 'baf'}
+
+def take_labels(line:str, labels, found):
+    '''
+    Stores the text after every label (see SUMMARY_LABELS) occuring in line in found, only the first occurence of a label counts
+    '''
+    for label, key in labels.items():
+        if key not in found:
+            position = line.find(label)
+            if position != -1:
+                found[key] = line[position + len(label):]
 
-    # Extracting data using patterns and storing the processed data in a dict
-    processed = {}
-    processed['SMILES'] = smiles_pattern.search(data).group(1)
-    processed['CHEM'] = chem_pattern.search(data).group(1)
-    processed['CAS'] = cas_pattern.search(data).group(1)
-    processed['ChemID'] = chemid_pattern.search(data).group(1)
-    processed['mol_for'] = molfor_pattern.search(data).group(1)
-    processed['mol_weight'] = result_to_float(molwt_pattern.search(data).group(1))
-    
-    processed['kow'] = result_to_float(kow_pattern.search(modelparams).group(1))
-    processed['kow_model'] = kow_pattern.search(modelparams).group(2)
-    processed['solubility'] = result_to_float(solubility_pattern.search(modelparams).group(1))
-    processed['solubility_model'] = solubility_pattern.search(modelparams).group(2)
+def require(found, labels, section:str):
+    '''
+    Checks that every label of a section was found, the output of the compound can not be used otherwise
+    '''
+    for label, key in labels.items():
+        if key not in found:
+            raise ValueError(f"{section}: '{label.strip()}' not found in EPI suite output")
 
-    # Extracting data for the simulated animal tests
-    tests_processed = {}
+def model_value(text:str):
+    '''
+    Splits an ECOSAR parameter like "-0.14  (KOWWIN v1.68 estimate)" into its value and the model in brackets
+    '''
+    value, rest = text.split(" ", 1)
+    return value, rest[rest.index("(") + 1:rest.rindex(")")]
 
-    # tests are isolated from the output, the part starts with multiple '=' and always ends in a 'Note'.
-    # can have a variable amount of lines in between depending on the amount of tests that were simulated.
-    tests_pattern = re.compile(r"=====.*?\n(.*) Note", re.DOTALL)
-    tests = tests_pattern.search(data).group(0)
+def regression_value(text:str, name:str):
+    '''
+    Splits a BCFBAF result like " 0.50 (BCF = 3.16 L/kg wet-wt)" into the log value and the value
+    '''
+    log_value, rest = text.split(f"({name} = ", 1)
+    return log_value.strip(), rest.split(" ", 1)[0].strip()
 
-    # Each test result is on a new line
-    tests = tests.split('\n')
-    
-    tests_list = []
-    for test in tests:
-        try:
-            # The tests are listed in a table format, cells in this table are devided using multiple spaces
-            splittest = test.split('   ')
-
-            # Cleaning up of extra spaces and other information
-            parts_list = []
-            for part in splittest:
-                cleaned_part = part.replace(":","")
-                cleaned_part = cleaned_part.strip()
-                if len(cleaned_part) > 0:
-                    parts_list.append(cleaned_part)
-
-            # Required information is extracted from the cleaned table
-            test_results = {}
-            test_results['ecosar_class'] = parts_list[0]
-            test_results['organism'] = parts_list[1]
-            test_results['duration'] = parts_list[2]
-            test_results['endpoint'] = parts_list[3]
-
-            # Sometimes asterixes are used to provide a note about solubility being to low to express the predicted effects in real tests.
-            # This information is extracted, but not used further in the PyroDB project.
-            if '*' in parts_list[4]:
-                test_results['solubility_error'] = True
-
-            # The asterix is cleaned off when it was present after flagging its existence
-            test_results['predicted_conc'] = result_to_float(parts_list[4].replace(" *",""))
-
-            # results are stored
-            tests_list.append(test_results)
-        except:
-            pass
-
-    # store test results list in the output dict
-    processed['tests'] = tests_list
-    return processed
-
-def extract_biowin(raw_data):
-    '''
-    Extract BioWin data from EPI suite output data returns results for each of the 7 models and the ready biodegradation prediction
-    '''
-
-    # Isolate BioWin data from raw_data
-    data_pattern = re.compile(r"BIOWIN .*? Program Results:(.*?)\n\n\n\n",re.DOTALL)
-    data = data_pattern.search(raw_data).group(0)
-
-    # Set up patterns for extracting the conclusion of each of the models included in BioWin
-    biowin1_pattern = re.compile(r"Biowin1 \(Linear Model Prediction\)    :  (.*?)\n",re.DOTALL)
-    biowin2_pattern = re.compile(r"Biowin2 \(Non-Linear Model Prediction\):  (.*?)\n",re.DOTALL)
-    biowin3_pattern = re.compile(r"Biowin3 \(Ultimate Biodegradation Timeframe\):  (.*?)\n",re.DOTALL)
-    biowin4_pattern = re.compile(r"Biowin4 \(Primary  Biodegradation Timeframe\):  (.*?)\n",re.DOTALL)
-    biowin5_pattern = re.compile(r"Biowin5 \(MITI Linear Model Prediction\)    :  (.*?)\n",re.DOTALL)
-    biowin6_pattern = re.compile(r"Biowin6 \(MITI Non-Linear Model Prediction\):  (.*?)\n",re.DOTALL)
-    biowin7_pattern = re.compile(r"Biowin7 \(Anaerobic Model Prediction\):  (.*?)\n",re.DOTALL)
-    ready_pattern = re.compile(r"Ready Biodegradability Prediction:  (.*?)\n",re.DOTALL)
-
-    # Use patterns to retrieve model conslusions, store these with model numbers
-    results = {}
-    results['1'] = biowin1_pattern.search(data).group(1)
-    results['2'] = biowin2_pattern.search(data).group(1)
-    results['3'] = biowin3_pattern.search(data).group(1)
-    results['4'] = biowin4_pattern.search(data).group(1)
-    results['5'] = biowin5_pattern.search(data).group(1)
-    results['6'] = biowin6_pattern.search(data).group(1)
-    results['7'] = biowin7_pattern.search(data).group(1)
-    results['ready'] = ready_pattern.search(data).group(1)
-
-    # The model conclusions are based on numerical model outputs, these are stored for each model as [model_number][_value]
-    # Outputs look as follows, the desired value is (if split at the '|' character) at index 3:
-    # RESULT   |   Biowin7 (Anaerobic Linear Biodeg Prob)   |         |  0.7555
-    # Each of the models contains such output in order of appearance with the exclusion of ready biodegradability.
-    # I'm sorry for the horrible name of the pattern variable name
-    testtest = re.compile(r"(RESULT.*?)\n",re.DOTALL)
-    for number, i in enumerate(testtest.findall(data)):
-        results[f"{number+1}_value"] = result_to_float(i.split('|')[3].strip())
-
-    return results
-
-def extract_bcfbaf(raw_input):
-    '''
-    Extracts BCFBAF model values from EPI suite output
-    '''
-
-    # BCF and BAF patterns
-    # All useable values are captured in 2 lines, both the log and and the non log version
-    bcf_pattern = re.compile("Log BCF \(regression-based estimate\):(.*?)\(BCF = (.*?) ", re.DOTALL)
-    baf_pattern = re.compile("Log BAF \(Arnot-Gobas upper trophic\):(.*?)\(BAF = (.*?) ", re.DOTALL)
-
-    # Extracting data using defined patterns
-    result = {}
-    result['log_bcf'] = result_to_float(bcf_pattern.search(raw_input).group(1).strip())
-    result['bcf'] = result_to_float(bcf_pattern.search(raw_input).group(2).strip())
-    result['log_baf'] = result_to_float(baf_pattern.search(raw_input).group(1).strip())
-    result['baf'] = result_to_float(baf_pattern.search(raw_input).group(2).strip())
-    
-    return result
+def scan_compound(raw_data):
+    '''
+    Extracts the base information (user given ID, whether EPI suite used its own database), the EPI summary, ECOSAR, BIOWIN and BCFBAF results
+    of one compound, walking over the lines of its output only once.
+    Every line is handed to the section it belongs to, the summary values are only read from the EPI summary.
+    Returns a dict with the results of each section, raises ValueError when a section is incomplete
+    '''
+    base = {}
+    summary, in_summary = {}, False
+    ecosar, parameters, tests, in_ecosar, ecosar_done, in_parameters, in_tests = {}, {}, [], False, False, False, False
+    biowin, biowin_values, in_biowin, biowin_done, empty_lines = {}, [], False, False, 0
+    bcfbaf = {}
+
+    for line in raw_data.split("\n"):
+        # Base information: the first CHEM line is the id, EPI suite only shows a CAS number when it used its own database
+        if 'id' not in base and "CHEM   : " in line:
+            base['id'] = line[line.index("CHEM   : ") + 9:]
+        if 'using_db' not in base and "CAS Num  :  " in line:
+            base['using_db'] = True
+
+        # The summary starts at its header, its values are the first ones after it
+        if not in_summary and "------------------------------ EPI SUMMARY" in line:
+            in_summary = True
+        if in_summary and len(summary) < len(SUMMARY_LABELS):
+            take_labels(line, SUMMARY_LABELS, summary)
+
+        # BIOWIN section, ends at three empty lines
+        if in_biowin:
+            if line:
+                empty_lines = 0
+                if len(biowin) < len(BIOWIN_LABELS):
+                    take_labels(line, BIOWIN_LABELS, biowin)
+                if "RESULT" in line:
+                    biowin_values.append(line[line.index("RESULT"):])
+            else:
+                empty_lines += 1
+                if empty_lines == 3:
+                    in_biowin, biowin_done = False, True
+        elif not biowin_done and "BIOWIN " in line and " Program Results:" in line:
+            in_biowin = True
+
+        # BCF and BAF are single lines
+        if len(bcfbaf) < len(BCFBAF_LABELS) and "Log B" in line:
+            take_labels(line, BCFBAF_LABELS, bcfbaf)
+
+        # ECOSAR section, from its version line up to the first line with a note
+        if not in_ecosar and not ecosar_done and "ECOSAR Version" in line:
+            in_ecosar = True
+            line = line[line.index("ECOSAR Version"):]
+        if in_ecosar:
+            last_line = "Note:" in line
+            if len(ecosar) < len(ECOSAR_LABELS):
+                take_labels(line, ECOSAR_LABELS, ecosar)
+
+            # The parameters used follow their header, the table of tests follows its line of '='
+            if not in_parameters and "Values used to Generate" in line:
+                in_parameters = True
+            elif in_parameters and len(parameters) < len(ECOSAR_PARAMETER_LABELS):
+                take_labels(line, ECOSAR_PARAMETER_LABELS, parameters)
+            if not in_tests and "=====" in line:
+                in_tests = True
+                line = line[line.index("====="):]
+            if in_tests:
+                test = parse_ecosar_test(line[:line.rindex(" Note") + 5] if last_line and " Note" in line else line)
+                if test:
+                    tests.append(test)
+
+            if last_line:
+                in_ecosar, ecosar_done = False, True
+
+    # Put the results together per section, every section has to be complete
+    if 'id' not in base:
+        raise ValueError("base: 'CHEM   :' not found in EPI suite output")
+    require(summary, SUMMARY_LABELS, "EPI summary")
+    require(ecosar, ECOSAR_LABELS, "ECOSAR")
+    require(parameters, ECOSAR_PARAMETER_LABELS, "ECOSAR")
+    require(biowin, BIOWIN_LABELS, "BIOWIN")
+    require(bcfbaf, BCFBAF_LABELS, "BCFBAF")
+
+    processed_ecosar = {key: ecosar[key] for key in ECOSAR_LABELS.values()}
+    processed_ecosar['mol_weight'] = result_to_float(ecosar['mol_weight'])
+    for key in ECOSAR_PARAMETER_LABELS.values():
+        value, model = model_value(parameters[key])
+        processed_ecosar[key] = result_to_float(value)
+        processed_ecosar[f"{key}_model"] = model
+    processed_ecosar['tests'] = tests
+
+    processed_biowin = {key: biowin[key] for key in BIOWIN_LABELS.values()}
+    for number, result in enumerate(biowin_values):
+        processed_biowin[f"{number+1}_value"] = result_to_float(result.split('|')[3].strip())
+
+    log_bcf, bcf = regression_value(bcfbaf['bcf'], "BCF")
+    log_baf, baf = regression_value(bcfbaf['baf'], "BAF")
+
+    return {'base_info': {'id': base['id'], 'using_db': base.get('using_db', False)},
+            'epi_summary': {key: result_to_float(summary[key]) for key in SUMMARY_LABELS.values()},
+            'ecosar': processed_ecosar,
+            'biowin': processed_biowin,
+            'bcfbaf': {'log_bcf': result_to_float(log_bcf), 'bcf': result_to_float(bcf),
+                       'log_baf': result_to_float(log_baf), 'baf': result_to_float(baf)}}
 
 
 def assessment(test_results):
@@ -269,41 +390,55 @@ def get_toxicity(ecosar):
     toxicity = 'T' if max_concentration <= 0.01 else ''
     return toxicity
 
-def extract_base(raw_data):
+def get_inchi(ident:str, ident_file = "translation.txt"):
     '''
-    Extracts some base information like the user given ID of a compound and whether CAS data was used during the run
+    Translates the user specified ID back into the InChI of the compound
+    Reads the whole translation file for one ID, use load_translation to translate many IDs
     '''
+    return read_translation(ident_file).get(ident)
 
-    # Setting up patterns
-    entryid_pattern = re.compile("CHEM   : (.*?)\n", re.DOTALL)
-    usingdb_pattern = re.compile("CAS Num  :  ")
-
-    # Extracting data from patterns
-    entry_id = entryid_pattern.search(raw_data).group(1)
-    usingdb_result = usingdb_pattern.search(raw_data)
-
-    # Turning the result from usingdb into a True/False flag, a cas number is only presented through EPI suite if it uses data from the internal database
-    usingdb = True if usingdb_result else False
-    
-    return {'id':entry_id, 'using_db':usingdb}
-
-def get_inchi(ident:str, ident_file = "translation.txt"):
+def read_translation(ident_file = "translation.txt"):
     '''
-    Translates the user specified ID back into the InChI of the compound
+    Reads a translation file written by episuite_input.py into a dict of ID to InChI
     '''
-    # Open and read the translation file
+    translation = {}
     with open(ident_file) as file:
-        translation = file.read().splitlines()
-
-    # Find the correct ID, and return associated InChI
-    for i in translation:
-        i = i.split('\t')
-        if i[0] == ident:
-            return i[1]
-
-def store_result(inchi, result, conn, cur):
+        for line in file:
+            parts = line.rstrip('\n').split('\t')
+            # The first occurence of an ID counts, like when searching the file
+            if len(parts) > 1:
+                translation.setdefault(parts[0], parts[1])
+    return translation
+
+def load_translation(cur, ident_file = None):
     '''
-    Stores assessment results and data used to get the result into the dataset.db file
+    Returns a dict of ID to InChI, read once so every ID is translated without searching.
+    The translation is read from the EPI_translation table, or from a translation file when one is given
+    '''
+    if ident_file:
+        return read_translation(ident_file)
+    cur.execute('SELECT epi_id, inchi FROM EPI_translation')
+    return dict(cur.fetchall())
+
+# Stores an assessment, or replaces the stored assessment of the same InChI so a output file can be processed again
+UPSERT_ECOTOXICITY = """INSERT INTO Ecotoxicity(inchi,P,B,T,S,using_stored,BCFBAF,ECOSAR,BIOWIN2,BIOWIN3,BIOWIN6,solubility,compound_id)
+                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,(SELECT id FROM Compounds WHERE inchi = ?))
+                        ON CONFLICT(inchi) DO UPDATE SET P = excluded.P,
+                                                         B = excluded.B,
+                                                         T = excluded.T,
+                                                         S = excluded.S,
+                                                         using_stored = excluded.using_stored,
+                                                         BCFBAF = excluded.BCFBAF,
+                                                         ECOSAR = excluded.ECOSAR,
+                                                         BIOWIN2 = excluded.BIOWIN2,
+                                                         BIOWIN3 = excluded.BIOWIN3,
+                                                         BIOWIN6 = excluded.BIOWIN6,
+                                                         solubility = excluded.solubility,
+                                                         compound_id = excluded.compound_id"""
+
+def assessment_row(inchi, result):
+    '''
+    Creates the row of the Ecotoxicity table for an assessment result, in the order of UPSERT_ECOTOXICITY
     '''
 
     # Turns the True/False into 1/0 respectively
@@ -317,8 +452,8 @@ def store_result(inchi, result, conn, cur):
             test['predicted_conc'] <= max_concentration):
             max_concentration = test['predicted_conc']
 
-    # Creates a tuple of the data in the correct order
-    data = (inchi,
+    # Creates a tuple of the data in the correct order, the InChI is repeated to find the compound (see compounds.py)
+    return (inchi,
             get_persistence(result['biowin']),
             get_bioaccumulativity(result['bcfbaf']),
             get_toxicity(result['ecosar']),
@@ -329,86 +464,103 @@ def store_result(inchi, result, conn, cur):
             result['biowin']['2_value'],
             result['biowin']['3_value'],
             result['biowin']['6_value'],
-            result['ecosar']['kow'])
+            result['ecosar']['kow'],
+            inchi)
 
-    # Stores the assessment results and important values in the database
-    cur.execute("""INSERT INTO Ecotoxicity(inchi,P,B,T,S,using_stored,BCFBAF,ECOSAR,BIOWIN2,BIOWIN3,BIOWIN6,solubility) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""", data)
+def store_result(inchi, result, conn, cur):
+    '''
+    Stores assessment results and data used to get the result into the dataset.db file
+    '''
+    cur.execute(UPSERT_ECOTOXICITY, assessment_row(inchi, result))
     conn.commit()
 
-def main(infile):
+def store_results(rows, conn):
     '''
-    main process running for processing EPI suite data
+    Stores the rows of many assessments (see assessment_row) at once in a single transaction
+    Returns the amount of stored rows
     '''
+    with conn:
+        conn.executemany(UPSERT_ECOTOXICITY, rows)
+    return len(rows)
 
-    # setup database connection
-    conn, cur = db()
-
-    # get the full output file as one large string
-    with open(infile,'r') as f:
-        raw_data = f.read()
+def select_results(results):
+    '''
+    Chooses one result per ID of the EPI SMILES batch file from the results in the order of the output file.
+    All variations of SMILES of a compound share the ID and follow each other in the output:
+      if one of them used stored data from the internal EPI suite database, the first of those is chosen and the rest is ignored
+      otherwise the last result of the ID is chosen
+    Yields the chosen results
+    '''
+    last_id = None
+    last_result = None
+    found_stored = False
 
-    # split the full output string into a list with an entry for each individual run
-    compound_tests = split_compounds(raw_data)
+    for test_results in results:
+        # Retrieve the ID corresponding to the EPI SMILES batch file
+        current_id = test_results['base_info']['id'].split("_")[0]
 
-    last_id = '0'
-    found_stored = False
-    last_result = []
+        # When a new ID starts without a result using stored data for the previous ID, the last result of the previous ID is chosen
+        if current_id != last_id:
+            if last_result is not None and not found_stored:
+                yield last_result
+            found_stored = False
 
-    for test in compound_tests:
-        # Set up a dictionary to store model results
-        test_results = {}
+        # A result using data from the internal EPI suite database is chosen right away
+        if test_results['base_info']['using_db'] and not found_stored:
+            found_stored = True
+            yield test_results
 
-        # Retrieve data for each model
-        test_results['base_info'] = extract_base(test)
-        test_results['epi_summary'] = extract_epi_summary(test)
-        test_results['ecosar'] = extract_ecosar(test)
-        test_results['biowin'] = extract_biowin(test)
-        test_results['bcfbaf'] = extract_bcfbaf(test)
+        last_result = test_results
+        last_id = current_id
 
-        # Retrieve the ID corresponding to the EPI SMILES batch file
-        current_id = test_results['base_info']['id'].split("_")[0]
+    # The last ID has no next ID to trigger choosing its result
+    if last_result is not None and not found_stored:
+        yield last_result
 
-        # pseudocode explaining how the data to store into the database was chosen:
-        # for each new id:
-        #   if this id data used stored info, store this info an stop processing this id by setting found flag true
-        #   if we found no stored and we start processing a new id now store the old one
-        #   if we're processing a new id and the found store flag is still true, reset it to false
+def main(infile, processes:int = 1, encoding:str = ENCODING, store:bool = False, show:bool = True, ident_file = None):
+    '''
+    main process running for processing EPI suite data
+    The assessments are printed when show is set, and stored in the database when store is set
+    IDs are translated with the EPI_translation table, or with the translation file ident_file when given
+    '''
 
-        # If no test using data from the internal EPI suite database was found, we store the last result
-        if not found_stored and current_id != last_id:
-            
-            # Show assessment data, uncomment line below to enable output on screen
-            assessment(last_result)
+    # setup database connection
+    conn, cur = db()
 
-            found_stored = False
-            
-            # Store result to the database, uncomment line below to stop storing in the database
-##            store_result(get_inchi(last_id), last_result, conn, cur)
+    # The translation of IDs to InChIs is loaded once for all results
+    translation = load_translation(cur, ident_file) if store else {}
 
-        # Reset the flag that indicates a test using data from the EPI internal database was found when processing a new test
-        elif found_stored and current_id != last_id:
-            
-            found_stored = False
+    # Rows are collected and stored together at the end
+    rows = []
 
-        # When a test using data from the internal EPI suite database is found it is stored and the rest of the tests for the same compound id are ignored
-        if test_results['base_info']['using_db'] and not found_stored:
-            # Uncomment the line below to show assessment data on screen
+    # The output file is read one compound at a time, by several processes when processes is more than 1
+    for test_results in select_results(parse_compounds(infile, processes, encoding)):
+        # Show assessment data on screen
+        if show:
             assessment(test_results)
 
-            # Uncomment below to prevent storing data in the compound entry database
-##            store_result(get_inchi(current_id), test_results, conn, cur)
-
-            # Set flag to ignore other tests on the same compound
-            found_stored = True
+        if store:
+            ident = test_results['base_info']['id'].split("_")[0]
+            inchi = translation.get(ident)
+            if inchi is None:
+                print(f"ID {ident} has no translation, its result is not stored")
+                continue
+            rows.append(assessment_row(inchi, test_results))
 
-        # store the data of this test for one cycle for when we need to store the previous test
-        last_result = test_results
-        last_id = current_id
-##        assessment_result = assessment(test_results)
+    if store:
+        print(f"Stored {store_results(rows, conn)} assessment results")
+    conn.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
     # specifies the EPI suite full output file to use
-    infile = "new_results.OUT"
+    parser.add_argument('infile', nargs='?', default="new_results.OUT", help="EPI suite FULL output file")
+    parser.add_argument('--processes', type=int, default=1, help=f"Processes extracting the results at the same time, this computer has {os.cpu_count()} cores")
+    parser.add_argument('--encoding', default=ENCODING, help="Encoding of the output file")
+    parser.add_argument('--store', action='store_true', help="Store the assessment results in the Ecotoxicity table, replacing earlier results of the same compounds")
+    parser.add_argument('--quiet', action='store_true', help="Do not print the assessment results")
+    parser.add_argument('--translation', metavar='FILE', help="Translate IDs with this translation file instead of the EPI_translation table")
+    args = parser.parse_args()
 
     # run the process to automatically add the EPI suite results to the compound entry database
-    main(infile)
+    main(args.infile, args.processes, args.encoding, args.store, not args.quiet, args.translation)
@@ -1,11 +1,15 @@
 """
-Creates a SMILES batch file with ID's for use with EPI suite and a translation file to translate between a generated id and an InChI
+Creates a SMILES batch file with ID's for use with EPI suite, and stores the translation between an id and an InChI in the
+EPI_translation table of the database (optionally also in a translation file)
+The id of a compound is its id in the Compounds table (see compounds.py)
 """
-import sqlite3
+import argparse
+
+import storage
 
 def db(database = "dataset.db"):
     '''Sets up a database connecion and returns this connection and a cursor object'''
-    conn = sqlite3.Connection(database)
+    conn = storage.connect(database)
     cur = conn.cursor()
     return conn, cur
 
@@ -35,60 +39,62 @@ def add_list(ident, values):
     if values["pc_isosmile"]:
         add_epi_input(f"{ident}_pi",values["pc_isosmile"])
 
-def add_translation(ident, inchi):
+def add_translation(ident, inchi, path:str = "translation.txt"):
     '''
     Adds to (and creates if it doesnt exists) a file linking the identification number to a InChI
     Mind that this file is tab separated for readability which is different from the EPI input file!
     '''
-    with open("translation.txt", "a+") as f:
+    with open(path, "a+") as f:
         f.write(f"{ident}\t{inchi}\n")
 
+def store_translations(translations, conn):
+    '''
+    Stores (id, InChI, compound id) rows in the EPI_translation table, replacing earlier rows with the same id
+    '''
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO EPI_translation(epi_id, inchi, compound_id) VALUES (?,?,?)',
+                         [(str(ident), inchi, compound_id) for ident, inchi, compound_id in translations])
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--translation-file', nargs='?', const="translation.txt", metavar='FILE',
+                        help="Also write the translation to a tab separated text file (default translation.txt)")
+    args = parser.parse_args()
+
     # sets up database
     conn, cur = db()
 
-    # retrieves InChIs and all available smiles
+    # retrieves every compound referenced by an identified entry once, with all available smiles
+    # A compound usually has one CAS and one PubChem record, the smiles of the first one are used when it has more
     cur.execute("""
-                SELECT DISTINCT
-                    Compound_entries.id,
-                    CAS_data.inchi as "CAS inchi",
-                    PC_data.inchi as "PC inchi",
+                SELECT
+                    Compounds.id,
+                    Compounds.inchi,
                     CAS_data.smile as "CAS smile",
                     CAS_data.canonical_smile as "CAS can_smile",
                     PC_data.canonical_smiles as "PC_can_smile",
                     PC_data.isometric_smiles as "PC_iso_smile"
                 FROM
-                    Compound_entries
+                    Compounds
                 LEFT JOIN
-                    CAS_data ON CAS_data.cas_rn = Compound_entries.CAS_data_id
+                    CAS_data ON CAS_data.rowid = (SELECT MIN(rowid) FROM CAS_data WHERE compound_id = Compounds.id)
                 LEFT JOIN
-                    PC_data ON PC_data.cid = Compound_entries.PC_data_id
+                    PC_data ON PC_data.cid = (SELECT MIN(cid) FROM PC_data WHERE compound_id = Compounds.id)
                 WHERE
-                    NOT (Compound_entries.CAS_data_id IS NULL AND Compound_entries.PC_data_id IS NULL)
-                GROUP BY
-                    Compound_entries.id
+                    EXISTS (SELECT 1 FROM Compound_entries WHERE Compound_entries.compound_id = Compounds.id)
+                ORDER BY
+                    Compounds.id
                 """)
     results = cur.fetchall()
 
-    # Sets up a dictionary to store InChI as keys and smiles as data
-    inchi_list = {}
-
-    # Process results
+    # Create the EPI suite input file, and the translation file when asked for
     for i in results:
-        # Takes InChI to use as the InChI provided by the CAS register if available, otherwise uses the InChI to the one from PubChem
-        # Due to the design of the identification script these should be the same if both are available
-        cas_inchi = i[1]
-        pc_inchi = i[2]
-        inchi = cas_inchi if cas_inchi else pc_inchi
-
-        # Only adds InChI unique InChI to the list to process
-        if not inchi in inchi_list.keys():
-            inchi_list[inchi] = {"cas_smile":i[3],"cas_cansmile":i[4],"pc_cansmile":i[5],"pc_isosmile":i[6]}
+        if args.translation_file:
+            add_translation(i[0], i[1], args.translation_file)
+        add_list(i[0], {"cas_smile":i[2],"cas_cansmile":i[3],"pc_cansmile":i[4],"pc_isosmile":i[5]})
 
-    # Create both output files
-    for index, i in enumerate(inchi_list.keys()):
-        add_translation(index, i)
-        add_list(index, inchi_list[i])
+    # The translation is stored in the database for epi_processor.py, the id is the compound id
+    store_translations([(i[0], i[1], i[0]) for i in results], conn)
 
     # Prints some statistics to indicate the script has finished 
-    print(f"Created output files for {len(inchi_list)} compounds")
+    print(f"Created output files for {len(results)} compounds")
@@ -0,0 +1,403 @@
+"""
+Local stand-in for the CAS Common Chemistry and PubChem PUG REST API's, for profiling and testing without network access.
+
+Modes:
+* record: forwards every request to the real services and stores the responses in a recordings database
+* replay: answers requests with the recorded responses, requests that were never recorded get a 404
+* synthetic: generates consistent made up compounds for any name, useful for benchmarks of any size
+
+Latency and errors (503 responses) can be injected to imitate slow or unreliable services.
+Point the scripts at the server with the PYRODB_CAS_URL and PYRODB_PUBCHEM_URL environment variables:
+    python fake_api.py --mode replay --port 8089
+    PYRODB_CAS_URL=http://127.0.0.1:8089/api PYRODB_PUBCHEM_URL=http://127.0.0.1:8089/rest/pug PYRODB_CACHE=fake_cache.db python auto_identifier.py
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from cas_api import CAS_API_URL
+from pubchem_api import PUBCHEM_API_URL
+
+# URL prefixes of both services on the stand-in server
+CAS_PREFIX = "/api"
+PUBCHEM_PREFIX = "/rest/pug"
+
+# Prefix of the made up InChI strings of synthetic compounds, the compound name follows it
+SYNTHETIC_INCHI = "InChI=1S/synthetic/"
+
+
+class Recordings:
+    '''
+    Recorded responses stored in SQLite, keyed by method, path, query string and form data
+    '''
+
+    def __init__(self, path:str = "recordings.db"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS recordings(method TEXT NOT NULL,
+                                                                   path TEXT NOT NULL,
+                                                                   params TEXT NOT NULL,
+                                                                   status INTEGER NOT NULL,
+                                                                   content_type TEXT,
+                                                                   body BLOB,
+                                                                   PRIMARY KEY(method, path, params))''')
+        self.conn.commit()
+
+    def get(self, method, path, params):
+        with self.lock:
+            return self.conn.execute('SELECT status, content_type, body FROM recordings WHERE method = ? AND path = ? AND params = ?',
+                                     (method, path, params)).fetchone()
+
+    def set(self, method, path, params, status, content_type, body):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO recordings(method, path, params, status, content_type, body) VALUES (?,?,?,?,?,?)',
+                              (method, path, params, status, content_type, body))
+            self.conn.commit()
+
+
+class Synthetic:
+    '''
+    Generates compounds for any name. Identifiers are derived from the name so every run gives the same answers,
+    and every lookup path (name, CAS number, CID, InChI) leads back to the same compound.
+    A fraction of the names (miss_rate) is unknown to both services.
+    '''
+
+    def __init__(self, miss_rate:float = 0.0):
+        self.miss_rate = miss_rate
+        self.lock = threading.Lock()
+        self.by_rn = {}
+        self.by_cid = {}
+
+    def known(self, name):
+        return zlib.crc32(name.lower().encode()) % 1000 >= self.miss_rate * 1000
+
+    def register(self, name):
+        '''
+        Returns the CAS number and CID of a name and remembers the name for detail lookups
+        '''
+        number = zlib.crc32(name.lower().encode())
+        rn = f"{number % 9999999}-{number % 97:02d}-{number % 10}"
+        cid = number % 99999999 + 1
+
+        with self.lock:
+            self.by_rn[rn] = name
+            self.by_cid[cid] = name
+        return rn, cid
+
+    def name_from(self, query):
+        '''
+        Returns the compound name for a name, synthetic InChI or InChIKey query
+        '''
+        if query.startswith(SYNTHETIC_INCHI):
+            return query[len(SYNTHETIC_INCHI):]
+        if query.startswith("InChIKey=") or query.startswith("KEY-"):
+            with self.lock:
+                return next((name for name in self.by_cid.values() if self.inchikey(name) == query.replace("InChIKey=", "")), None)
+        return query
+
+    def inchikey(self, name):
+        return f"KEY-{zlib.crc32(name.lower().encode()):010d}-N"
+
+    def cas_search(self, query):
+        name = self.name_from(query)
+        if not name or not self.known(name):
+            return 200, {'count': 0, 'results': []}
+
+        rn, cid = self.register(name)
+        return 200, {'count': 1, 'results': [{'rn': rn, 'name': name, 'image': ''}]}
+
+    def cas_detail(self, rn):
+        with self.lock:
+            name = self.by_rn.get(rn)
+        if not name:
+            return 404, {'message': 'Detail not found'}
+
+        return 200, {'rn': rn,
+                     'uri': f"substance/pt/{rn.replace('-', '')}",
+                     'name': name,
+                     'image': '',
+                     'inchi': SYNTHETIC_INCHI + name,
+                     'inchiKey': "InChIKey=" + self.inchikey(name),
+                     'smile': 'CCO',
+                     'canonicalSmile': 'CCO',
+                     'molecularFormula': 'C<sub>2</sub>H<sub>6</sub>O',
+                     'molecularMass': '46.07',
+                     'experimentalProperties': [{'name': 'Boiling Point', 'property': '78.2 °C', 'sourceNumber': 1},
+                                                {'name': 'Melting Point', 'property': '-114.1 °C', 'sourceNumber': 1}],
+                     'propertyCitations': [{'docUri': '', 'sourceNumber': 1, 'source': 'Synthetic data'}],
+                     'synonyms': [name, f"{name} (synthetic)"],
+                     'replacedRns': [],
+                     'hasMolfile': False}
+
+    def pc_cids(self, namespace, query):
+        name = self.name_from(query) if namespace == 'inchi' else query
+        if not name or not self.known(name):
+            return 404, {'Fault': {'Code': 'PUGREST.NotFound', 'Message': 'No CID found'}}
+
+        rn, cid = self.register(name)
+        return 200, {'IdentifierList': {'CID': [cid]}}
+
+    def pc_properties(self, cids):
+        properties = []
+        for cid in cids:
+            with self.lock:
+                name = self.by_cid.get(cid)
+            if name:
+                properties.append({'CID': cid, 'MolecularFormula': 'C2H6O', 'MolecularWeight': '46.07', 'SMILES': 'CCO',
+                                   'ConnectivitySMILES': 'CCO', 'InChI': SYNTHETIC_INCHI + name, 'InChIKey': self.inchikey(name),
+                                   'IUPACName': name, 'XLogP': -0.1, 'ExactMass': '46.041864811', 'MonoisotopicMass': '46.041864811'})
+        if not properties:
+            return 404, {'Fault': {'Code': 'PUGREST.NotFound'}}
+        return 200, {'PropertyTable': {'Properties': properties}}
+
+    def pc_synonyms(self, cids):
+        information = []
+        for cid in cids:
+            with self.lock:
+                name = self.by_cid.get(cid)
+            if name:
+                information.append({'CID': cid, 'Synonym': [name, f"{name} (synthetic)", f"SYN-{cid}"]})
+        if not information:
+            return 404, {'Fault': {'Code': 'PUGREST.NotFound'}}
+        return 200, {'InformationList': {'Information': information}}
+
+    def pc_record(self, cid):
+        with self.lock:
+            name = self.by_cid.get(cid)
+        if not name:
+            return 404, {'Fault': {'Code': 'PUGREST.NotFound'}}
+
+        # Just enough of a PC_Compounds record for pubchempy.Compound
+        label = lambda label, value, name=None: {'urn': dict({'label': label}, **({'name': name} if name else {})), 'value': value}
+        return 200, {'PC_Compounds': [{'id': {'id': {'cid': cid}},
+                                       'atoms': {'aid': [1, 2, 3], 'element': [6, 6, 8]},
+                                       'bonds': {'aid1': [1, 2], 'aid2': [2, 3], 'order': [1, 1]},
+                                       'coords': [{'type': [1, 5, 255], 'aid': [1, 2, 3], 'conformers': [{'x': [0.0, 1.0, 2.0], 'y': [0.0, 0.5, 0.0]}]}],
+                                       'charge': 0,
+                                       'props': [label('IUPAC Name', {'sval': name}, 'Preferred'),
+                                                 label('InChI', {'sval': SYNTHETIC_INCHI + name}, 'Standard'),
+                                                 label('InChIKey', {'sval': self.inchikey(name)}, 'Standard'),
+                                                 label('Molecular Formula', {'sval': 'C2H6O'}),
+                                                 label('Molecular Weight', {'sval': '46.07'}),
+                                                 label('SMILES', {'sval': 'CCO'}, 'Absolute'),
+                                                 label('SMILES', {'sval': 'CCO'}, 'Connectivity'),
+                                                 {'urn': {'label': 'Fingerprint', 'implementation': 'E_SCREEN'}, 'value': {'binary': '00000371' + '0' * 222}}]}]}
+
+    def answer(self, method, path, query, form):
+        '''
+        Returns (status, JSON body) for a request
+        '''
+        if path == f"{CAS_PREFIX}/search":
+            return self.cas_search(query.get('q', ''))
+        if path == f"{CAS_PREFIX}/detail":
+            return self.cas_detail(query.get('cas_rn', ''))
+
+        # PUG REST paths: /compound/<namespace>/[cids|synonyms|property/<properties>]/JSON
+        parts = path[len(PUBCHEM_PREFIX):].strip('/').split('/')
+        if len(parts) >= 3 and parts[0] == 'compound':
+            namespace = parts[1]
+            identifier = form.get(namespace, query.get(namespace, ''))
+            if parts[2] == 'cids':
+                return self.pc_cids(namespace, identifier)
+            if namespace == 'cid' and parts[2] == 'property':
+                return self.pc_properties([int(cid) for cid in identifier.split(',') if cid])
+            if namespace == 'cid' and parts[2] == 'synonyms':
+                return self.pc_synonyms([int(cid) for cid in identifier.split(',') if cid])
+            if namespace == 'cid':
+                return self.pc_record(int(identifier))
+
+            # Full records by name or InChI
+            status, result = self.pc_cids(namespace, identifier)
+            if status != 200:
+                return status, result
+            return self.pc_record(result['IdentifierList']['CID'][0])
+
+        return 404, {'message': 'Unknown endpoint'}
+
+
+def endpoint_name(path):
+    '''
+    Short name of the endpoint of a request path, used for request counts
+    '''
+    if path.startswith(CAS_PREFIX + "/"):
+        return "cas_" + path[len(CAS_PREFIX) + 1:]
+
+    parts = path[len(PUBCHEM_PREFIX):].strip('/').split('/')
+    if len(parts) >= 3:
+        return f"pc_{parts[1]}_{parts[2].lower() if parts[2] in ('cids', 'property', 'synonyms') else 'record'}"
+    return "unknown"
+
+
+class FakeAPI:
+    '''
+    The stand-in server, runs in a background thread
+    '''
+
+    def __init__(self, mode:str = "replay", recordings:str = "recordings.db", host:str = "127.0.0.1", port:int = 0,
+                 latency:float = 0.0, jitter:float = 0.0, error_rate:float = 0.0, miss_rate:float = 0.0, seed=None):
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        self.recordings = Recordings(recordings) if mode in ("record", "replay") else None
+        self.synthetic = Synthetic(miss_rate) if mode == "synthetic" else None
+        self.upstream = requests.Session()
+
+        # Amount of requests per endpoint, and of replay requests that were never recorded
+        self.counts = {}
+        self.replay_misses = 0
+        self.counts_lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def cas_url(self):
+        return self.url + CAS_PREFIX
+
+    @property
+    def pubchem_url(self):
+        return self.url + PUBCHEM_PREFIX
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, path):
+        with self.counts_lock:
+            name = endpoint_name(path)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def delay_and_fail(self):
+        '''
+        Waits the injected latency, returns True when this request should fail
+        '''
+        with self.random_lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def upstream_url(self, path):
+        if path.startswith(CAS_PREFIX):
+            return CAS_API_URL + path[len(CAS_PREFIX):]
+        return PUBCHEM_API_URL + path[len(PUBCHEM_PREFIX):]
+
+    def respond(self, method, target, body):
+        '''
+        Returns (status, content type, body bytes) for a request
+        '''
+        split = urlsplit(target)
+        path = split.path
+        query = dict(parse_qsl(split.query))
+        form = dict(parse_qsl(body.decode())) if body else {}
+        self.count(path)
+
+        if self.delay_and_fail():
+            return 503, "application/json", b'{"message": "Injected error"}'
+
+        if self.mode == "synthetic":
+            status, result = self.synthetic.answer(method, path, query, form)
+            return status, "application/json", json.dumps(result).encode()
+
+        # Recordings are keyed on the sorted parameters so the order in which a client sends them does not matter
+        params = urlencode(sorted(query.items()) + sorted(form.items()))
+
+        if self.mode == "replay":
+            recorded = self.recordings.get(method, path, params)
+            if recorded is None:
+                with self.counts_lock:
+                    self.replay_misses += 1
+                return 404, "application/json", b'{"message": "Not recorded"}'
+            return recorded
+
+        # Record mode
+        response = self.upstream.request(method, self.upstream_url(path), params=query, data=form or None, timeout=60)
+        content_type = response.headers.get('Content-Type', 'application/json')
+        self.recordings.set(method, path, params, response.status_code, content_type, response.content)
+        return response.status_code, content_type, response.content
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, with Nagle's algorithm the body waits for the client's delayed ACK (~40 ms)
+            disable_nagle_algorithm = True
+
+            def handle_request(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+
+                try:
+                    status, content_type, content = fake.respond(method, self.path, body)
+                except requests.RequestException as error:
+                    status, content_type, content = 502, "application/json", json.dumps({'message': str(error)}).encode()
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, format, *args):
+                # Keep the console quiet, the request counts are reported when the server stops
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=["record", "replay", "synthetic"], default="replay")
+    parser.add_argument('--recordings', default="recordings.db", help="SQLite file holding the recorded responses")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds, up to this value, added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 503 error")
+    parser.add_argument('--miss-rate', type=float, default=0.0, help="Fraction of names unknown to both services in synthetic mode")
+    parser.add_argument('--seed', type=int, help="Seed for the injected latency and errors")
+    args = parser.parse_args()
+
+    fake = FakeAPI(args.mode, args.recordings, args.host, args.port, args.latency, args.jitter, args.error_rate, args.miss_rate, args.seed)
+    print(f"Serving {args.mode} mode, set PYRODB_CAS_URL={fake.cas_url} and PYRODB_PUBCHEM_URL={fake.pubchem_url}")
+
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(f"Requests: {fake.counts}")
+        if args.mode == "replay":
+            print(f"Requests that were not recorded: {fake.replay_misses}")
@@ -0,0 +1,111 @@
+"""
+Trigram similarity of compound names, used by identifier.py to rank the candidates of the manual identification
+and to suggest already stored compounds with a similar name.
+"""
+import re
+
+from names import normalize_name
+
+# Accept a candidate without asking when its name has the same normalized key as the compound name (see names.normalize_name).
+# Similar names are never accepted automatically: a methyl and an ethyl ester, or an ethyl and an ethenyl group, score above 0.9
+AUTO_ACCEPT = True
+
+# Stored names scoring below this similarity are not suggested
+MIN_SIMILARITY = 0.5
+
+NUMBERS = re.compile(r"\d+")
+
+def trigrams(name:str):
+    '''
+    Returns the set of 3 character sequences of a normalized name, padded so the start and end of the name count as well
+    '''
+    padded = f"  {normalize_name(name)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(a:str, b:str):
+    '''
+    Jaccard similarity of the trigrams of two names, 1.0 for names that normalize to the same key
+    '''
+    if not a or not b:
+        return 0.0
+    first, second = trigrams(a), trigrams(b)
+    return len(first & second) / len(first | second)
+
+def same_numbers(a:str, b:str):
+    '''
+    True when both names contain the same numbers in the same order.
+    Isomers like 1-butene and 2-butene are similar by trigrams, but only differ in their locants
+    '''
+    return NUMBERS.findall(normalize_name(a)) == NUMBERS.findall(normalize_name(b))
+
+def rank(name:str, candidates, key=lambda candidate: candidate['name']):
+    '''
+    Sorts candidates (dicts) from most to least similar to name, the similarity is stored under 'score'.
+    Of equally similar candidates the ones with the same numbers as name come first
+    '''
+    for candidate in candidates:
+        candidate['score'] = similarity(name, key(candidate))
+    candidates.sort(key=lambda candidate: (candidate['score'], bool(key(candidate)) and same_numbers(name, key(candidate))), reverse=True)
+    return candidates
+
+def accept(name:str, candidate_name:str):
+    '''
+    Decides whether a candidate is certain enough to accept without asking the user, only when both names normalize to the same key.
+    The similarity is only used to rank the candidates, it does not see a different ester or alkyl group
+    '''
+    return bool(candidate_name) and normalize_name(name) == normalize_name(candidate_name)
+
+
+class TrigramIndex:
+    '''
+    Inverted index from trigram to names, finds the most similar stored names without comparing against every one of them
+    '''
+
+    def __init__(self):
+        self.names = []
+        self.records = []
+        self.sizes = []
+        self.postings = {}
+
+    def add(self, name:str, record):
+        number = len(self.names)
+        self.names.append(name)
+        self.records.append(record)
+
+        name_trigrams = trigrams(name)
+        self.sizes.append(len(name_trigrams))
+        for trigram in name_trigrams:
+            self.postings.setdefault(trigram, []).append(number)
+
+    def search(self, name:str, limit:int = 5, min_similarity:float = MIN_SIMILARITY):
+        '''
+        Returns up to limit (similarity, name, record) tuples for the stored names most similar to name
+        '''
+        query = trigrams(name)
+
+        # Count the shared trigrams per stored name, only names sharing at least one trigram are considered
+        shared = {}
+        for trigram in query:
+            for number in self.postings.get(trigram, ()):
+                shared[number] = shared.get(number, 0) + 1
+
+        # Jaccard similarity from the counts: |A & B| / (|A| + |B| - |A & B|)
+        results = []
+        for number, count in shared.items():
+            score = count / (len(query) + self.sizes[number] - count)
+            if score >= min_similarity:
+                results.append((score, self.names[number], self.records[number]))
+
+        results.sort(key=lambda result: (result[0], same_numbers(name, result[1])), reverse=True)
+        return results[:limit]
+
+    @classmethod
+    def from_synonyms(cls, cur):
+        '''
+        Builds the index over the synonym index of the database (see synonyms.py), records are (source, CAS number or CID)
+        '''
+        index = cls()
+        cur.execute('SELECT name, source, record FROM Synonyms')
+        for name, source, record in cur.fetchall():
+            index.add(name, (source, record))
+        return index
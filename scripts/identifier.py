@@ -1,199 +1,120 @@
-import sqlite3
-import os
-import cas_api
-import pubchempy
-import json
+import argparse
+import storage
+import synonyms
+import fuzzy
+import prefetch
+import pubchem_api
+from storage import store_data
+from work_queue import WorkQueue
+from api_client import APIError
+
+# Accept a candidate with the same normalized name as the entry without asking, see fuzzy.accept
+AUTO_ACCEPT = fuzzy.AUTO_ACCEPT
+
+# Trigram index over the stored names, built on first use (see local_index)
+_index = None
 
 def db(db_path:str = "dataset.db"):
     '''
     Establish DB connection
     '''
     
-    conn = sqlite3.Connection(db_path)
+    conn = storage.connect(db_path)
     cur = conn.cursor()
     
     return conn, cur
 
-def add_pc_data(pc_data, conn, cur):
+def add_skiplist(entry_id, cur, reason=None):
     '''
-    Add pubchem data if this cid is not yet in the dataset
+    Adds an ID to the skiplist
     '''
+    cur.execute('INSERT OR IGNORE INTO Skiplist(entry_id, reason) VALUES (?, ?)', (int(entry_id), reason))
+    cur.connection.commit()
 
-    # Creates dict version from the PubChemPy Compound object
-    pc_data = pc_data.to_dict()
-    
-    # Check for existing records for this identifier in the database, a new record is only added if it does not exist yet.
-    cur.execute('SELECT * FROM PC_data WHERE cid = ?', (pc_data['cid'],) )
-    results = cur.fetchall()
-
-    if not results:
-        # Create a tuple of the data to store in the correct order
-        write_data = (pc_data['cid'],
-                      str(pc_data['elements']),
-                      str(pc_data['atoms']),
-                      str(pc_data['bonds']),
-                      str(pc_data['molecular_formula']),
-                      pc_data['molecular_weight'],
-                      pc_data['canonical_smiles'],
-                      pc_data['isomeric_smiles'],
-                      pc_data['inchi'],
-                      pc_data['inchikey'],
-                      pc_data['iupac_name'],
-                      pc_data['xlogp'],
-                      pc_data['exact_mass'],
-                      pc_data['monoisotopic_mass'])
-
-        # create the actual record in the database
-        cur.execute('''INSERT INTO PC_data(cid,
-                                            elements,
-                                            atoms,
-                                            bonds,
-                                            molecular_formula,
-                                            molecular_weight,
-                                            canonical_smiles,
-                                            isometric_smiles,
-                                            inchi,
-                                            inchikey,
-                                            iupac_name,
-                                            xlogp,
-                                            exact_mass,
-                                            monoisotopic_mass)
-                                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', write_data)
-        conn.commit()
-    return True
-
-def add_cas_data(cas_data, conn, cur):
+def add_all_skiplist(entry_name, cur, entry_ids=None, reason=None):
     '''
-    Adds cas data to the table if the CAS nr is not yet in the table
+    Adds all IDs of compounds with the specified name to the skiplist, or the given entry_ids
     '''
+    if entry_ids:
+        cur.executemany('INSERT OR IGNORE INTO Skiplist(entry_id, reason) VALUES (?, ?)', [(int(entry_id), reason) for entry_id in entry_ids])
+    else:
+        # Add the id's of records with the same compound name in one statement
+        cur.execute('INSERT OR IGNORE INTO Skiplist(entry_id, reason) SELECT id, ? FROM Compound_entries WHERE lower(compound_name) = ?', (reason, entry_name.lower()))
+    cur.connection.commit()
 
-    # Check for existing records for this identifier in the database, a new record is only added if it does not exist yet.
-    cur.execute('SELECT * from CAS_data WHERE cas_rn = ?', (cas_data['rn'],))
-    result = cur.fetchall()
-    
-    if not result:
-        # Create a tuple of the data to store in the correct order
-        data = (str(cas_data['rn']),
-                str(cas_data['uri']),
-                str(cas_data['name']),
-                str(cas_data['smile']),
-                str(cas_data['canonicalSmile']),
-                str(cas_data['inchi']),
-                str(cas_data['inchiKey']),
-                str(cas_data['molecularFormula']),
-                str(cas_data['molecularMass']),
-                str(cas_data['experimentalProperties']),
-                str(cas_data['propertyCitations']),
-                str(cas_data['synonyms']),
-                str(cas_data['replacedRns']))
-
-        # create the actual record in the database
-        cur.execute('''INSERT INTO CAS_data(cas_rn,
-                                            uri,
-                                            name,
-                                            smile,
-                                            canonical_smile,
-                                            inchi,
-                                            inchikey,
-                                            molecular_formula,
-                                            molecular_weight,
-                                            documented_properties,
-                                            sources,
-                                            synonyms,
-                                            replaced_cas)
-                                        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)''', data)
-        conn.commit()
-    return True
-
-def store_data(entry_name, cas_find, pc_find, conn, cur):
+def check_skiplist(entry_id, cur):
     '''
-    Stores all available API data in the database and makes sure the compound is referencing the correct API data records
+    Check if an ID is present on the skiplist
     '''
+    cur.execute('SELECT 1 FROM Skiplist WHERE entry_id = ?', (int(entry_id),))
 
-    # Sets empty flags to be replaced by the PubChem or CAS identifier if available, if no identifier is available for either service, this remains None (thus empty).
-    cas = None
-    pc = None
-
-    # Stores CAS API data if available
-    if cas_find:
-        add_cas_data(cas_find, conn, cur)
-        cas = cas_find['rn']
+    # Returns True if the ID is present on the skiplist
+    return cur.fetchone() is not None
 
-    # Stores PubChem data if available
-    if pc_find:
-        add_pc_data(pc_find, conn, cur)
-        pc = pc_find.cid
-
-    # Add identifiers to the compound referencing the correct data records.
-    # By design this is done for every compound with the same name to for efficiency
-    cur.execute('UPDATE Compound_entries SET PC_data_id = ?, CAS_data_id = ? WHERE lower(compound_name) = ?', (pc, cas, entry_name.lower()))
-    conn.commit()
-   
-def add_skiplist(entry_id):
+def get_skiplist(cur):
     '''
-    Adds an ID to the skiplist text file
+    Returns the skiplisted IDs as a list object
     '''
-    # create skiplist file if it doesnt exist and add the id at the end of the file
-    with open("skiplist.txt",'a+') as skiplist:
-        skiplist.write(entry_id+'\n')
+    cur.execute('SELECT entry_id FROM Skiplist ORDER BY entry_id')
+    return [i[0] for i in cur.fetchall()]
 
-def add_all_skiplist(entry_name, cur):
+def import_skiplist(cur, path:str = "skiplist.txt", reason:str = "imported from skiplist.txt"):
     '''
-    Adds all IDs of compounds with the specified name to the skiplist
+    Bulk imports the IDs of an old skiplist text file (one id per line) into the Skiplist table.
+    Returns the amount of IDs that were not on the skiplist yet.
     '''
-    # retrieve the id's of records with the same compound name
-    cur.execute('SELECT id FROM Compound_entries WHERE lower(compound_name) = ?',(entry_name.lower(),))
+    with open(path) as skiplist:
+        entry_ids = [line.strip() for line in skiplist if line.strip()]
 
-    # Add those id's to the skiplist
-    for i in cur.fetchall():
-        add_skiplist(str(i[0]))
+    before = cur.execute('SELECT count(*) FROM Skiplist').fetchone()[0]
+    cur.executemany('INSERT OR IGNORE INTO Skiplist(entry_id, reason) VALUES (?, ?)', [(int(entry_id), reason) for entry_id in entry_ids])
+    cur.connection.commit()
 
-def check_skiplist(entry_id):
-    '''
-    Check if an ID is present on the skiplist
-    '''
-    skiplist = get_skiplist()
+    return cur.execute('SELECT count(*) FROM Skiplist').fetchone()[0] - before
 
-    # Returns True if the ID is present on the skiplist
-    if entry_id in skiplist:
-        return True
-    
-    return False
-
-def get_skiplist():
+def store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids=None):
     '''
-    Returns skiplist contents as a list object
+    Stores the chosen results (see storage.store_data), the PubChem synonyms and structure are retrieved first
+    so no request is made while the writes of the compound are in progress
     '''
+    if pc_find:
+        pc_find.load_details()
+    store_data(entry_name, cas_find, pc_find, conn, cur, entry_ids)
 
-    # Opens and reads file if it exists and returns a list of ID's
-    if os.path.exists("skiplist.txt"):
-        with open("skiplist.txt",'r') as skiplist:
-            skip = skiplist.read().splitlines()
-            
-    else:
-        # Return an empty list if there's no skiplist file
-        # the file will be created the first time an ID gets added to it
-        skip = []
-        
-    return skip
-          
-def next_entry(cur, skiplist = None):
+def run_local(entry_name:str, cur, entry_ids=None):
     '''
-    Returns the next database record that has not yet been identified and requires identification
+    Looks the name up in the synonym index of already stored compounds, without any API request
+    Returns "full" or "partial" when the entries were linked to the stored CAS and/or PubChem records, None when the name is unknown
+    Does not commit
     '''
+    cas_rn, cid = synonyms.lookup(cur, entry_name)
+    if cas_rn is None and cid is None:
+        return None
 
-    # retrieves the skiplist if none was given when calling this function
-    if not skiplist:
-        skiplist = get_skiplist()
+    storage.link_data(entry_name, cas_rn, cid, cur, entry_ids)
+    print(f"Found in synonym index: CAS {cas_rn}, PC {cid}")
+    return "full" if cas_rn is not None and cid is not None else "partial"
 
-    # Because the skiplist has a variable length, the amount of variables to filter for should have a custom amount of '?' to use as placeholders
-    skipstring = ','.join(len(skiplist)*'?')
+def local_index(cur):
+    '''
+    Returns the trigram index over all names in the synonym index, built once per run
+    '''
+    global _index
+    if _index is None:
+        _index = fuzzy.TrigramIndex.from_synonyms(cur)
+    return _index
 
-    # SQL to retrieve one database record that has no associated CAS or PubChem ID and does not occur on the skiplist
-    cur.execute('SELECT id, compound_name FROM Compound_entries WHERE (CAS_data_id IS NULL AND PC_data_id IS NULL) AND id NOT IN (%s)' % skipstring, skiplist)
-    return cur.fetchone()
+def local_candidates(entry_name:str, cur, limit:int = 5):
+    '''
+    Stored compounds with a name similar to the entry name, as candidates for the manual identification
+    '''
+    candidates = {}
+    for score, name, record in local_index(cur).search(entry_name, limit * 2):
+        candidates.setdefault(name, {'result': {'name': name, 'records': []}, 'origin': 'local', 'name': name})
+        candidates[name]['result']['records'].append(record)
+    return list(candidates.values())[:limit]
 
-def run_compound(entry_id:int, entry_name:str, conn, cur):
+def run_compound(entry_id:int, entry_name:str, conn, cur, entry_ids=None, lookups=None):
     '''
     Automatic and manual verification of compounds using several steps:
     1. Check whether one of the compound names matches completely -> accept that match and sync the apis using InChI
@@ -202,15 +123,14 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
     4. Give option for not being able to correctly verify a compound using any of the available means
     
     Upon verification of a compound, API data is added to the database
+    entry_ids are the ids of all entries sharing the normalized name of this entry, these are all updated at once
+    lookups (see prefetch.Lookups) holds the API results that were already retrieved in the background
     '''
-
-    # Indicate new entry and show stats
-    print("===========================================")
-    print(f"Current compound: {entry_name} | {compounds_to_go(cur)} left")
+    lookups = lookups or prefetch.Lookups()
 
     # Retrieve data from both API's
-    pc_data = pubchempy.get_compounds(entry_name, 'name')
-    cas_data = json.loads(cas_api.search(entry_name))['results']
+    pc_data = lookups.get_compounds(entry_name, 'name')
+    cas_data = lookups.search(entry_name)['results']
 
     # Set flags for confirmed results to False
     pc_find = False
@@ -225,7 +145,7 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
             print("Found CAS by name")
 
             # Set the found result to the result of the /details of the CAS api for this registration number
-            cas_find = cas_api.details(i['rn'])
+            cas_find = lookups.details(i['rn'])
             
             # Sometimes CAS api does not have an InChI, ifso we remove undo the verification and let the user handle the situation
             if not cas_find['inchi']:
@@ -233,16 +153,16 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
                 break
 
             # Search the PubChem database using the InChI to match results
-            pc_result = pubchempy.get_compounds(cas_find['inchi'], 'inchi')
+            pc_result = lookups.get_compounds(cas_find['inchi'], 'inchi')
 
             # InChI should only describe 1 compound, if it matches more then one this could indicate ambiguity
             if len(pc_result) == 1:
                 pc_find = pc_result[0]
-                print(f"PC {pc_find.to_dict()['cid']} found from inchi")
+                print(f"PC {pc_find.cid} found from inchi")
 
     # Store results in database on automatch of both PubChem and CAS 
     if cas_find and pc_find:
-        store_data(entry_name, cas_find, pc_find, conn, cur)
+        store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids)
         return True
 
     # PubChem Automatching
@@ -255,23 +175,23 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
     for i in pc_data:
         
         # Accept result on full IUPAC name match
-        if entry_name.lower() == i.to_dict()['iupac_name'].lower():
+        if i.iupac_name and entry_name.lower() == i.iupac_name.lower():
             pc_find = i
 
             # Search the CAS register for the InChI.
             # this statement might be the origin of the bug; a possible untested solution might be:
-            # cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchi'].replace("InChI=","")))['results']
+            # cas_result = lookups.search(pc_find.inchi.replace("InChI=",""))['results']
             # fixing this bug is outside the scope of the project, but could be useful for future use of the script
-            cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchi']))['results']
+            cas_result = lookups.search(pc_find.inchi)['results']
 
             # If a result was found throught CAS search, the chemical information is requested from the CAS API /details
             if cas_result:
-                cas_find = cas_api.details(cas_result[0]['rn'])
+                cas_find = lookups.details(cas_result[0]['rn'])
                 print(f"CAS {cas_find['rn']} found from inchi")
     
     # Store results in database on automatch of both PubChem and CAS        
     if cas_find and pc_find:
-        store_data(entry_name, cas_find, pc_find, conn, cur)
+        store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids)
         return True
 
     # -- COMMENT OUT TO DISABLE PubChem Automatch [END]
@@ -285,38 +205,67 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
     # if manual entry was used or CAS/CID was selected from the list -> add the other through inchi
 
     # Create one list of results to print, and store information about the origin of the data
-    # because both require their own method of storing due to the difference in data provided through both APIs
+    # because both require their own method of storing due to the difference in data provided through both APIs.
+    # Stored compounds with a similar name are offered as well, choosing one of those needs no API requests
     total_results = []
     for result in pc_data:
-        total_results.append({'result':result, 'origin':'pc'})
+        total_results.append({'result':result, 'origin':'pc', 'name':result.iupac_name})
 
     for result in cas_data:
-        total_results.append({'result':result, 'origin':'cas'})
+        total_results.append({'result':result, 'origin':'cas', 'name':result['name']})
+
+    total_results += local_candidates(entry_name, cur)
+
+    # Most similar names first, the first result is preselected
+    fuzzy.rank(entry_name, total_results)
+
+    # Accept the best result right away when it has the same name as the entry, similar names are only preselected
+    auto_accept = AUTO_ACCEPT and bool(total_results) and fuzzy.accept(entry_name, total_results[0]['name'])
 
     # Information for the user about how to progress
-    print("Type index number and press enter to confirm")
+    print("Type index number and press enter to confirm, or only press enter for the first result")
 
     # Show the user the third-party identifier and the name provided through the API
     for index, result in enumerate(total_results):
         if result['origin'] == 'pc':
             ident = result['result'].cid
-            name = result['result'].iupac_name
-        else:
+        elif result['origin'] == 'cas':
             ident = result['result']['rn']
-            name = result['result']['name']
-        print(f'{index}:\t{ident}\t-\t{name}')
+        else:
+            ident = "stored " + ", ".join(f"{source} {record}" for source, record in result['result']['records'])
+        print(f"{index}:\t{ident}\t-\t{result['name']}\t({result['score']:.0%})")
 
     while True:
-        # Request the user to choose an index of a result or one of the three other options (skiplist, manual pubchem entry or manual CAS entry) 
-        print("Or press 's' to add to skiplist, 'mp' for manual PubChem CID, 'mc' for manual CAS number")
-        choice = input('>')
+        if auto_accept:
+            print(f"Accepted {total_results[0]['name']} (same name)")
+            choice = "0"
+            auto_accept = False
+        else:
+            # Request the user to choose an index of a result or one of the three other options (skiplist, manual pubchem entry or manual CAS entry)
+            print("Or press 's' to add to skiplist, 'mp' for manual PubChem CID, 'mc' for manual CAS number")
+            choice = input('>').strip()
+
+        # Enter selects the preselected first result
+        if choice == "" and total_results:
+            choice = "0"
 
         # == SELECTED LISTED RESULT == 
         # If the choice is a numerical, it indicates the user chose one of the results.
-        if choice.isdigit():
+        if choice.isdigit() and int(choice) < len(total_results):
             # user chose one of the proposed entries
             chosen = total_results[int(choice)]
-            
+
+            # Stored compound chosen, link the entries to the records that are known under this name
+            if chosen['origin'] == 'local':
+                cas_rn, cid = synonyms.lookup(cur, chosen['name'])
+                if cas_rn is None and cid is None:
+                    # The name is ambiguous, use the first record shown
+                    source, record = chosen['result']['records'][0]
+                    cas_rn, cid = (record, None) if source == synonyms.CAS else (None, int(record))
+
+                storage.link_data(entry_name, cas_rn, cid, cur, entry_ids)
+                return True
+
             # PubChem chosen
             if chosen['origin'] == 'pc':
                 # Store the chosen PubChem data
@@ -325,30 +274,30 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
                 # Search the CAS register using the InChIKey. It seems that I ran into problems using InChI
                 # presumably due to the the InChI= part still being in front of the InChI which is not included in the InChIKey.
                 # This did work well however
-                cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchikey']))['results']
+                cas_result = lookups.search(pc_find.inchikey)['results']
                 if cas_result:
-                    cas_find = cas_api.details(cas_result[0]['rn'])
+                    cas_find = lookups.details(cas_result[0]['rn'])
                     print(f"CAS {cas_find['rn']} found from inchi")
 
             # CAS chosen
             else:
                 # Store the chosen CAS data
-                cas_find = cas_api.details(chosen['result']['rn'])
+                cas_find = lookups.details(chosen['result']['rn'])
 
                 # search PubChem by InChI
-                pc_result = pubchempy.get_compounds(cas_find['inchi'], 'inchi')
+                pc_result = lookups.get_compounds(cas_find['inchi'], 'inchi')
                 if len(pc_result) == 1:
                     pc_find = pc_result[0]
-                    print(f"PC {pc_find.to_dict()['cid']} found from inchi")
+                    print(f"PC {pc_find.cid} found from inchi")
 
             # Store whatever APIs returned data for the chosen compound into the Database and end the function
-            store_data(entry_name, cas_find, pc_find, conn, cur)
+            store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids)
             return True
 
         # == SELECTED SKIPLIST ==
         elif choice.lower() == "s":
             # add to skiplist
-            add_all_skiplist(entry_name, cur)
+            add_all_skiplist(entry_name, cur, entry_ids, reason="skipped during manual identification")
             return False
 
         # == SELECTED MANUAL PUBCHEM ENTRY ==
@@ -362,7 +311,7 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
                     break
 
             # Search PubChem for the CID
-            pc_result = pubchempy.get_compounds(cid, 'cid')
+            pc_result = lookups.get_compounds(cid, 'cid')
 
             # Accept the result if this indeed only resulted in one option
             if len(pc_result) == 1:
@@ -370,13 +319,13 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
 
                 # use the InChI to search the CAS register --> this due to it being an InChI including "InChI=" might again result in no CAS results
                 # that's why it was opted to not use the manual PubChem unless no suitable CAS number could be found manually
-                cas_result = json.loads(cas_api.search(pc_find.to_dict()['inchi']))['results']
+                cas_result = lookups.search(pc_find.inchi)['results']
                 if cas_result:
-                    cas_find = cas_api.details(cas_result[0]['rn'])
+                    cas_find = lookups.details(cas_result[0]['rn'])
                     print(f"CAS {cas_find['rn']} found from inchi")
 
             # Store the API data in the database for whatever API returned data
-            store_data(entry_name, cas_find, pc_find, conn, cur)
+            store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids)
             return True
                 
         # == SELECTED MANUAL CAS ENTRY ==
@@ -392,55 +341,70 @@ def run_compound(entry_id:int, entry_name:str, conn, cur):
                     break
 
             # Use the user input to request API for the /details page
-            cas_result = cas_api.details(cas)
+            cas_result = lookups.details(cas)
 
             # If the CAS details are available store the CAS result
             if cas_result:
                 cas_find = cas_result
 
                 # Use the InChI to search the cas register
-                pc_result = pubchempy.get_compounds(cas_find['inchi'], 'inchi')
+                pc_result = lookups.get_compounds(cas_find['inchi'], 'inchi')
 
                 # Only one compound should match this InChI
                 if len(pc_result) == 1:
                     pc_find = pc_result[0]
-                    print(f"PC {pc_find.to_dict()['cid']} found from inchi")
+                    print(f"PC {pc_find.cid} found from inchi")
 
             # Store the API data of whatever API returned data
-            store_data(entry_name, cas_find, pc_find, conn, cur)
+            store_resolved(entry_name, cas_find, pc_find, conn, cur, entry_ids)
             return True
         
 
-def compounds_to_go(cur, skiplist=None):
-    '''
-    Prints amount of entries that require data and are not present on the skiplist
-    '''
-    # This functions very similar to retrieving the next entry
-    # if no skiplist was provided, retrieve the current skiplist
-    if not skiplist:
-        skiplist = get_skiplist()
-
-    # create a variable length string of '?' to allow for the amount of variables in the SQL statements as there are IDs in the skiplist
-    skipstring = ','.join(len(skiplist)*'?')
-
-    # Retrieve the count of distinct compound names that have no associated CAS or PubChem data and are not present on the skiplist
-    cur.execute('SELECT count(DISTINCT lower(compound_name)) FROM Compound_entries WHERE (CAS_data_id IS NULL AND PC_data_id IS NULL) AND id NOT IN (%s)' % skipstring, skiplist)
-    return cur.fetchone()[0]
-
-
 if __name__ == "__main__":
     
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--import-skiplist', nargs='?', const="skiplist.txt", metavar='FILE', help="Import the ids of an old skiplist text file (default skiplist.txt) into the database and exit")
+    parser.add_argument('--prefetch', type=int, default=prefetch.DEPTH, metavar='N', help=f"Retrieve the API results of the next N compounds in the background (default {prefetch.DEPTH}), 0 disables this")
+    parser.add_argument('--prefetch-memory', type=float, default=prefetch.MEMORY_BUDGET / 1024 / 1024, metavar='MB', help="Maximum size of the prefetched results in MB")
+    parser.add_argument('--no-auto-accept', action='store_true', help="Always ask, also when the first result has the same name as the compound")
+    parser.add_argument('--structures', action='store_true', help="Also store PubChem elements, atoms and bonds (one extra request per stored compound)")
+    args = parser.parse_args()
+
+    AUTO_ACCEPT = not args.no_auto_accept
+    pubchem_api.STRUCTURES = args.structures
+
     # Setup the database connection
     conn,cur = db()
-    
-    while True:
-        # Retrieve the next entry
-        entry_id, entry_name = next_entry(cur)
 
-        # if no more entries are available end the loop
-        if not entry_name:
-            print("No more entries.")
+    if args.import_skiplist:
+        print(f"Added {import_skiplist(cur, args.import_skiplist)} IDs to the skiplist")
+        exit(0)
+
+    # All distinct compound names that require identification and are not on the skiplist, grouped by normalized name
+    work = WorkQueue(cur, skipped=False)
+    
+    # The API results of the next compounds are retrieved while the user decides on the current one
+    # Names in the synonym index need no API results
+    unknown = lambda item: synonyms.lookup(cur, item['name']) == (None, None)
+    for item, lookups in prefetch.Prefetcher(work, args.prefetch, args.prefetch_memory * 1024 * 1024, needed=unknown):
+        entry_id, entry_name = item['ids'][0], item['name']
+
+        # Indicate new entry and show stats
+        print("===========================================")
+        print(f"Current compound: {entry_name} | {work.remaining} left")
+
+        # Names of compounds that are already stored need no API requests, otherwise
+        # stop when a service remains unavailable after retrying, rerunning the script continues where it stopped
+        try:
+            identified = run_local(entry_name, cur, item['ids']) or run_compound(entry_id, entry_name, conn, cur, item['ids'], lookups)
+        except APIError as error:
+            print(f"API error for {entry_name}: {error}")
+            print("Stopping, run the script again to continue.")
             break
 
-        # if an entry is available procss the entry
-        run_compound(entry_id, entry_name, conn, cur)
+        # Manual decisions are valuable, so they are committed right away instead of in batches
+        conn.commit()
+
+        work.mark(item, "identified" if identified else "skipped")
+    else:
+        print("No more entries.")
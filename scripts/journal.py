@@ -0,0 +1,57 @@
+"""
+Run journal of auto_identifier.py, stored in the "Run_journal" table of dataset.db.
+Records the outcome of every attempted compound name so a restarted run continues where the previous one stopped,
+instead of repeating the API requests for names that were already tried.
+"""
+import re
+
+# Outcomes that leave the entries without data, names with these are not tried again by later runs
+# unless asked for with retry_older_than. API errors ("error") are temporary and always retried.
+FAILED = ("failure",)
+
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+def parse_age(text:str):
+    '''
+    Converts an age like "90", "30m", "12h" or "7d" to seconds, a number without unit is in seconds
+    '''
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", text.lower())
+    if not match:
+        raise ValueError(f"Invalid age '{text}', use a number followed by s, m, h, d or w")
+    return float(match.group(1)) * AGE_UNITS[match.group(2) or 's']
+
+def record(cur, item, status:str, error:str = None):
+    '''
+    Records the outcome of a work item (see names.build_work_set) in the journal
+    Does not commit, the outcome is committed together with the stored results of the name
+    '''
+    cur.execute('''INSERT INTO Run_journal(name_key, name, status, attempts, error)
+                   VALUES (?,?,?,1,?)
+                   ON CONFLICT(name_key) DO UPDATE SET name = excluded.name,
+                                                       status = excluded.status,
+                                                       attempts = attempts + 1,
+                                                       error = excluded.error,
+                                                       finished_at = CURRENT_TIMESTAMP''',
+                (item['key'], item['name'], status, error))
+
+def finished_keys(cur, retry_older_than:float = None):
+    '''
+    Returns the normalized names that earlier runs already tried without result and should not be tried again.
+    With retry_older_than (seconds), failures older than that are left out so they are tried again.
+    '''
+    placeholders = ','.join('?' * len(FAILED))
+
+    if retry_older_than is None:
+        cur.execute(f'SELECT name_key FROM Run_journal WHERE status IN ({placeholders})', FAILED)
+    else:
+        cur.execute(f'''SELECT name_key FROM Run_journal WHERE status IN ({placeholders})
+                        AND finished_at >= datetime('now', ?)''', FAILED + (f'-{retry_older_than} seconds',))
+
+    return {key for key, in cur.fetchall()}
+
+def counts(cur):
+    '''
+    Returns the amount of journaled names per outcome
+    '''
+    cur.execute('SELECT status, count(*) FROM Run_journal GROUP BY status')
+    return dict(cur.fetchall())
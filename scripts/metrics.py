@@ -0,0 +1,319 @@
+"""
+Instrumentation of identifier runs: latency histograms, counters and gauges,
+exported as a periodic JSON snapshot file and as a Prometheus text endpoint.
+
+The API clients, the response cache and the storage layer record into the shared REGISTRY,
+so a slow run can be traced to the API's, SQLite or the identification loop itself.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prefix of every exported metric name
+PREFIX = "pyrodb_"
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Descriptions shown in the Prometheus output
+HELP = {
+    'api_request_seconds': "Duration of single API requests (every attempt) per endpoint",
+    'api_requests_total': "API requests per endpoint and response status",
+    'api_retries_total': "Retried API requests per endpoint",
+    'api_failures_total': "API requests that failed after all retries per endpoint",
+    'cache_lookups_total': "Response cache lookups per endpoint, result is hit or miss",
+    'resolve_seconds': "Time to resolve one compound name, API requests included",
+    'db_store_seconds': "Time to write the results of one compound",
+    'db_commit_seconds': "Time of one database commit",
+    'writer_queue_depth': "Results waiting for the database writer",
+    'work_remaining': "Compound names that still have to be resolved",
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    '''
+    Counts observations per bucket, like a Prometheus histogram
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        '''
+        Returns (upper bound, observations up to that bound) pairs
+        '''
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        '''
+        Estimates a quantile as the upper bound of the bucket it falls in
+        '''
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'max': round(self.max, 6)}
+
+
+class Registry:
+    '''
+    Thread safe collection of histograms, counters and gauges, each identified by a name and a set of labels
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def observe(self, name:str, value:float, **labels):
+        '''
+        Adds an observation (usually a duration in seconds) to a histogram
+        '''
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(label_key(labels))
+            if histogram is None:
+                histogram = series[label_key(labels)] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name:str, amount:float = 1, **labels):
+        '''
+        Increases a counter
+        '''
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name:str, function, **labels):
+        '''
+        Registers a gauge, function is called for its current value every time the metrics are exported
+        '''
+        with self.lock:
+            self.gauges.setdefault(name, {})[label_key(labels)] = function
+
+    def remove_gauge(self, name:str, **labels):
+        with self.lock:
+            self.gauges.get(name, {}).pop(label_key(labels), None)
+
+    @contextlib.contextmanager
+    def timer(self, name:str, **labels):
+        '''
+        Observes the duration of the with block in a histogram
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge_values(self):
+        # Gauge functions are called outside the lock, they might take locks of their own
+        with self.lock:
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+
+        values = {}
+        for name, series in gauges.items():
+            for key, function in series.items():
+                try:
+                    values.setdefault(name, {})[key] = function()
+                except Exception:
+                    continue
+        return values
+
+    def snapshot(self):
+        '''
+        Returns all metrics as a JSON serializable dict, labels are written as "name=value" strings
+        '''
+        gauges = self.gauge_values()
+
+        def series_dict(series, convert=lambda value: value):
+            return {",".join(f"{name}={value}" for name, value in key) or "all": convert(value) for key, value in series.items()}
+
+        with self.lock:
+            snapshot = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'uptime': round(time.time() - self.started, 1),
+                        'histograms': {name: series_dict(series, Histogram.to_dict) for name, series in self.histograms.items()},
+                        'counters': {name: series_dict(series) for name, series in self.counters.items()},
+                        'gauges': {name: series_dict(series) for name, series in gauges.items()}}
+
+            # The cache hit rate per endpoint, the question most often asked of the cache counters
+            hit_rate = {}
+            for key, count in self.counters.get('cache_lookups_total', {}).items():
+                labels = dict(key)
+                rate = hit_rate.setdefault(labels.get('endpoint'), {'hit': 0, 'miss': 0})
+                rate[labels.get('result')] = rate.get(labels.get('result'), 0) + count
+            snapshot['cache_hit_rate'] = {endpoint: round(counts['hit'] / (counts['hit'] + counts['miss']), 4)
+                                          for endpoint, counts in hit_rate.items() if counts['hit'] + counts['miss']}
+
+        return snapshot
+
+    def prometheus(self):
+        '''
+        Returns all metrics in the Prometheus text exposition format
+        '''
+        gauges = self.gauge_values()
+        lines = []
+
+        def header(name, kind):
+            if name in HELP:
+                lines.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        with self.lock:
+            for name, series in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for key, histogram in series.items():
+                    for bound, total in histogram.cumulative():
+                        lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', bound)])} {total}")
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(key)} {histogram.count}")
+
+            for name, series in sorted(self.counters.items()):
+                header(name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+
+        for name, series in sorted(gauges.items()):
+            header(name, "gauge")
+            for key, value in series.items():
+                lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Everything records into one registry
+REGISTRY = Registry()
+
+def observe(name:str, value:float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+def inc(name:str, amount:float = 1, **labels):
+    REGISTRY.inc(name, amount, **labels)
+
+def gauge(name:str, function, **labels):
+    REGISTRY.gauge(name, function, **labels)
+
+def remove_gauge(name:str, **labels):
+    REGISTRY.remove_gauge(name, **labels)
+
+def timer(name:str, **labels):
+    return REGISTRY.timer(name, **labels)
+
+
+class Exporter:
+    '''
+    Writes a JSON snapshot of the registry to a file every `interval` seconds and/or serves the metrics on an HTTP port.
+    The snapshot file is replaced atomically so it can be read at any moment.
+    '''
+
+    def __init__(self, registry:Registry = REGISTRY, path:str = None, interval:float = 30.0, port:int = None, host:str = "127.0.0.1"):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.writer = None
+        self.server = None
+
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), self.handler())
+            self.server.daemon_threads = True
+
+    def start(self):
+        if self.path:
+            self.writer = threading.Thread(target=self.write_periodically, daemon=True)
+            self.writer.start()
+        if self.server:
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def write_snapshot(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.registry.snapshot(), file, indent=2)
+        os.replace(temporary, self.path)
+
+    def write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write_snapshot()
+
+    def stop(self):
+        '''
+        Stops exporting, the snapshot file is written one last time so it holds the totals of the run
+        '''
+        self.stopped.set()
+        if self.writer:
+            self.writer.join()
+            self.write_snapshot()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] == "/metrics":
+                    body, content_type = registry.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path.split('?')[0] == "/snapshot":
+                    body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,72 @@
+"""
+Normalization of compound names, used to resolve every distinct chemical name only once.
+"""
+import re
+import unicodedata
+
+# Greek letters are written both as symbol and spelled out in the literature
+GREEK = {'α': 'alpha', 'β': 'beta', 'γ': 'gamma', 'δ': 'delta', 'ε': 'epsilon', 'ζ': 'zeta', 'η': 'eta', 'θ': 'theta',
+         'κ': 'kappa', 'λ': 'lambda', 'μ': 'mu', 'ν': 'nu', 'ξ': 'xi', 'π': 'pi', 'ρ': 'rho', 'σ': 'sigma',
+         'τ': 'tau', 'φ': 'phi', 'χ': 'chi', 'ψ': 'psi', 'ω': 'omega'}
+
+# Different dashes and quotes that end up in names copied from papers
+PUNCTUATION = {'‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '−': '-', '’': "'", '′': "'", '″': "''"}
+
+# Whitespace around the separators inside a systematic name ("2 - methyl", "1, 2-diol")
+SEPARATOR_SPACES = re.compile(r"\s*([-,()\[\]])\s*")
+
+# Stereo descriptors written without parentheses or in square brackets at the start of a name: "E-2-butene", "[Z]-..."
+# Only E and Z are rewritten, bare R- or S- prefixes could just as well be an S-locant (S-methyl ...)
+BARE_STEREO = re.compile(r"^[\[(]?([ez])[\])]?-")
+BRACKET_STEREO = re.compile(r"\[([0-9]*[rsez](?:,[0-9]*[rsez])*)\]")
+
+# The different ways racemic mixtures are written
+RACEMIC = re.compile(r"^\(?(?:\+/-|\+-|±|rac|dl)\)?-")
+
+def normalize_name(name:str):
+    '''
+    Returns a normalized key for a compound name.
+    Names that only differ in letter case, whitespace, Greek letters written as symbol or spelled out,
+    dash characters or the notation of stereo descriptors get the same key.
+    The stereo descriptors themselves are kept, (E) and (Z) isomers are different compounds.
+    '''
+    key = unicodedata.normalize('NFKC', name).lower()
+
+    for symbol, spelled in GREEK.items():
+        key = key.replace(symbol, spelled)
+    for character, replacement in PUNCTUATION.items():
+        key = key.replace(character, replacement)
+
+    # Collapse whitespace, and remove it around separators
+    key = ' '.join(key.split())
+    key = SEPARATOR_SPACES.sub(r"\1", key)
+
+    # Write stereo descriptors the same way: "(e)-", "(2e)-", "(±)-"
+    key = BARE_STEREO.sub(r"(\1)-", key)
+    key = BRACKET_STEREO.sub(r"(\1)", key)
+    key = RACEMIC.sub("(±)-", key)
+
+    return key
+
+def build_work_set(cur, skipped:bool = True):
+    '''
+    Groups all entries without CAS or PubChem data by normalized name.
+    Returns a dict of normalized name to {'key': normalized name, 'name': first name found, 'ids': [entry ids]}, in order of the first entry id.
+    With skipped set to False, entries on the skiplist are left out.
+    '''
+    if skipped:
+        cur.execute('SELECT id, compound_name FROM Compound_entries WHERE (CAS_data_id IS NULL AND PC_data_id IS NULL) ORDER BY id')
+    else:
+        # Anti-join against the skiplist, uses the primary key index of the Skiplist table
+        cur.execute('''SELECT id, compound_name FROM Compound_entries
+                       WHERE (CAS_data_id IS NULL AND PC_data_id IS NULL)
+                       AND NOT EXISTS (SELECT 1 FROM Skiplist WHERE Skiplist.entry_id = Compound_entries.id)
+                       ORDER BY id''')
+
+    work_set = {}
+    for entry_id, entry_name in cur.fetchall():
+        key = normalize_name(entry_name)
+        item = work_set.setdefault(key, {'key': key, 'name': entry_name, 'ids': []})
+        item['ids'].append(entry_id)
+
+    return work_set
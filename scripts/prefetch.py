@@ -0,0 +1,145 @@
+"""
+Background prefetching for identifier.py.
+While the user decides on one compound, worker threads already retrieve the API results of the next compounds,
+so the prompt for the next compound appears without waiting for the API's.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cas_api
+import pubchem_api
+
+# Amount of upcoming compounds retrieved in the background
+DEPTH = 3
+
+# Maximum size of the prefetched results held in memory, no new compounds are prefetched above this
+MEMORY_BUDGET = 64 * 1024 * 1024 # bytes
+
+# CAS details (and the PubChem compounds for their InChI) are retrieved for this many CAS search results per compound
+DETAIL_LIMIT = 5
+
+
+def approximate_size(value):
+    '''
+    Rough size of an API result in bytes, measured as the length of its text representation
+    '''
+    if isinstance(value, list):
+        return sum(approximate_size(part) for part in value)
+    if isinstance(value, pubchem_api.PCRecord):
+        return len(str(value.properties))
+    return len(str(value))
+
+
+class Lookups:
+    '''
+    The API lookups made for one compound, each result is retrieved once and kept for the identification of that compound.
+    Thread safe, so the prefetching thread and the user prompt can use it at the same time.
+    '''
+
+    def __init__(self):
+        self.results = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key, fetch):
+        with self.lock:
+            if key in self.results:
+                return self.results[key]
+
+        value = fetch()
+
+        with self.lock:
+            if key not in self.results:
+                self.results[key] = value
+                self.size += approximate_size(value)
+        return value
+
+    def search(self, query):
+        '''Same as cas_api.search'''
+        return self.lookup(('cas_search', query), lambda: cas_api.search(query))
+
+    def details(self, cas_rn):
+        '''Same as cas_api.details'''
+        return self.lookup(('cas_detail', cas_rn), lambda: cas_api.details(cas_rn))
+
+    def get_compounds(self, identifier, namespace:str = 'name'):
+        '''Same as pubchem_api.get_compounds'''
+        return self.lookup(('pc', namespace, identifier), lambda: pubchem_api.get_compounds(identifier, namespace))
+
+    def prefetch(self, entry_name):
+        '''
+        Makes the lookups identifier.run_compound is going to make for a compound name:
+        the name searches, the details of the first CAS results with the PubChem compounds for their InChI,
+        and the CAS search for PubChem results matching the name exactly
+        '''
+        pc_data = self.get_compounds(entry_name, 'name')
+        cas_data = self.search(entry_name)['results']
+
+        for result in cas_data[:DETAIL_LIMIT]:
+            details = self.details(result['rn'])
+            if details and details['inchi']:
+                self.get_compounds(details['inchi'], 'inchi')
+
+        for result in pc_data:
+            if result.iupac_name and entry_name.lower() == result.iupac_name.lower():
+                self.search(result.inchi)
+
+
+class Prefetcher:
+    '''
+    Iterates over work items (see work_queue.WorkQueue) and yields every item together with its Lookups,
+    while the lookups of the next `depth` items are made on background threads.
+    needed can be a function deciding whether an item needs API lookups at all, it is called on the iterating thread.
+    '''
+
+    def __init__(self, items, depth:int = DEPTH, memory_budget:int = MEMORY_BUDGET, needed=None):
+        self.items = items
+        self.depth = depth
+        self.memory_budget = memory_budget
+        self.needed = needed
+        self.pending = []
+
+    def held(self):
+        '''
+        Size of the prefetched results of the upcoming items
+        '''
+        return sum(lookups.size for item, lookups, future in self.pending)
+
+    def submit(self, pool, item):
+        lookups = Lookups()
+        if self.needed and not self.needed(item):
+            future = pool.submit(lambda: None)
+        else:
+            future = pool.submit(self.prefetch_safely, lookups, item['name'])
+        self.pending.append((item, lookups, future))
+
+    def prefetch_safely(self, lookups, entry_name):
+        # Failed lookups are simply made again, and reported, when the compound is identified
+        try:
+            lookups.prefetch(entry_name)
+        except Exception:
+            pass
+
+    def __iter__(self):
+        items = iter(self.items)
+        pool = ThreadPoolExecutor(max_workers=max(1, self.depth))
+        try:
+            while True:
+                # Keep `depth` items ahead of the user, unless the prefetched results grow over the memory budget
+                while len(self.pending) <= self.depth and (not self.pending or self.held() < self.memory_budget):
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    self.submit(pool, item)
+
+                if not self.pending:
+                    return
+
+                # The prefetch of the current item is usually finished, otherwise waiting for it is no slower than doing the lookups here
+                item, lookups, future = self.pending.pop(0)
+                future.result()
+                yield item, lookups
+        finally:
+            # Stopping early (the user quit or an API failed) should not wait for the upcoming items
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pending = []
@@ -0,0 +1,302 @@
+"""
+Wrapper around the PubChem PUG REST API.
+Compounds are retrieved as a small set of properties for many CIDs per request instead of one full record per compound,
+full records (atoms and bonds) are only requested when they are actually needed.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pubchempy
+
+import api_cache
+from api_client import APIClient, APIError
+
+# PubChem allows at most 5 requests per second
+# The PYRODB_PUBCHEM_URL environment variable points the scripts at another server, for example fake_api.py
+PUBCHEM_API_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+PUBCHEM_BASE_URL = os.environ.get("PYRODB_PUBCHEM_URL", PUBCHEM_API_URL)
+PUBCHEM_RATE = 5.0 # requests per second
+PUBCHEM_CONCURRENCY = 4 # requests in flight at the same time
+PUBCHEM_BURST = 5
+
+# Amount of CIDs requested in one property request, PubChem handles lists of a few hundred fine
+BATCH_SIZE = 100
+
+# The properties stored by add_pc_data, requested as PUG REST property names
+PROPERTIES = ('MolecularFormula', 'MolecularWeight', 'CanonicalSMILES', 'IsomericSMILES', 'InChI', 'InChIKey',
+              'IUPACName', 'XLogP', 'ExactMass', 'MonoisotopicMass')
+
+# Store the elements, atoms and bonds of a compound as well, this requires one full record request per stored compound
+STRUCTURES = False
+
+# Retrieve the synonyms of stored compounds for the synonym index (see synonyms.py), one request per stored compound.
+# PubChem lists up to thousands of depositor synonyms for common compounds, only the first SYNONYM_LIMIT are kept
+SYNONYMS = True
+SYNONYM_LIMIT = 100
+
+
+class PCRecord:
+    '''
+    Lightweight stand-in for pubchempy.Compound built from PUG REST properties.
+    Offers the attributes and to_dict() keys used by the identifier scripts.
+    '''
+
+    def __init__(self, properties, client):
+        self.properties = properties
+        self.client = client
+
+        self.cid = properties['CID']
+        self.molecular_formula = properties.get('MolecularFormula')
+        self.molecular_weight = to_float(properties.get('MolecularWeight'))
+        # PubChem renamed the SMILES properties, the old names are still accepted in requests but answered with the new ones
+        self.canonical_smiles = properties.get('CanonicalSMILES', properties.get('ConnectivitySMILES'))
+        self.isomeric_smiles = properties.get('IsomericSMILES', properties.get('SMILES'))
+        self.inchi = properties.get('InChI')
+        self.inchikey = properties.get('InChIKey')
+        self.iupac_name = properties.get('IUPACName')
+        self.xlogp = properties.get('XLogP')
+        self.exact_mass = to_float(properties.get('ExactMass'))
+        self.monoisotopic_mass = to_float(properties.get('MonoisotopicMass'))
+
+        # Filled by load_synonyms() and load_structure()
+        self.synonyms = None
+        self.structure_data = None
+
+    def __repr__(self):
+        return f"PCRecord({self.cid})"
+
+    def structure(self):
+        '''
+        Returns the elements, atoms and bonds from the full PubChem record
+        '''
+        compound = self.client.get_full_compounds(self.cid, 'cid')[0]
+        return compound.to_dict(properties=['elements', 'atoms', 'bonds'])
+
+    def load_synonyms(self):
+        '''
+        Retrieves the synonyms of this compound when SYNONYMS is enabled, call before storing the record.
+        Done separately from to_dict so the request is made on the thread resolving the compound, not by the database writer.
+        '''
+        if SYNONYMS and self.synonyms is None:
+            self.synonyms = self.client.synonyms([self.cid]).get(self.cid, [])
+        return self.synonyms
+
+    def load_structure(self):
+        '''
+        Retrieves the elements, atoms and bonds of this compound when STRUCTURES is enabled, call before storing the record
+        '''
+        if STRUCTURES and self.structure_data is None:
+            self.structure_data = self.structure()
+        return self.structure_data
+
+    def load_details(self):
+        '''
+        Makes all requests needed to store this compound (synonyms and structure), on the thread resolving the compound.
+        to_dict and storing the record make no requests, so a failing request can not interrupt the writes of a compound
+        '''
+        self.load_synonyms()
+        self.load_structure()
+
+    def to_dict(self):
+        '''
+        Same keys as pubchempy.Compound.to_dict() for the data that is stored,
+        elements, atoms and bonds are None unless they were retrieved by load_structure
+        '''
+        data = {'cid': self.cid,
+                'elements': None,
+                'atoms': None,
+                'bonds': None,
+                'molecular_formula': self.molecular_formula,
+                'molecular_weight': self.molecular_weight,
+                'canonical_smiles': self.canonical_smiles,
+                'isomeric_smiles': self.isomeric_smiles,
+                'inchi': self.inchi,
+                'inchikey': self.inchikey,
+                'iupac_name': self.iupac_name,
+                'xlogp': self.xlogp,
+                'exact_mass': self.exact_mass,
+                'monoisotopic_mass': self.monoisotopic_mass,
+                'synonyms': self.synonyms}
+
+        if self.structure_data:
+            data.update(self.structure_data)
+        return data
+
+
+def to_float(value):
+    '''
+    PubChem returns some numerical properties as strings
+    '''
+    return float(value) if value is not None else None
+
+
+class PubChemClient(APIClient):
+    '''
+    Client for PubChem PUG REST compound lookups
+    '''
+
+    def __init__(self, base_url:str = PUBCHEM_BASE_URL, rate:float = PUBCHEM_RATE, burst:int = PUBCHEM_BURST,
+                 concurrency:int = PUBCHEM_CONCURRENCY, cache=None, **kwargs):
+        super().__init__(base_url, rate=rate, burst=burst, concurrency=concurrency, **kwargs)
+
+        # Optional api_cache.ResponseCache, when given responses are served from it whenever possible
+        self.cache = cache
+
+    def lookup(self, endpoint:str, query, fetch):
+        '''
+        Calls fetch(query), through the response cache if there is one
+        '''
+        if self.cache is not None:
+            return self.cache.cached(endpoint, query, fetch)
+        return fetch(query)
+
+    def post_or_empty(self, path:str, data, endpoint:str = None):
+        '''
+        POST request returning None when PubChem has no results.
+        Identifiers are send as form data, like PubChemPy does, so names and InChIs containing '/' work.
+        '''
+        try:
+            return self.post_json(path, data=data, endpoint=endpoint)
+        except APIError as error:
+            # PubChem answers 404 when nothing matches and 400 for identifiers it can not parse, both mean no results
+            if error.status_code in (400, 404):
+                return None
+            raise
+
+    def cids(self, identifier, namespace:str = 'name'):
+        '''
+        Returns the CIDs matching an identifier in the given namespace ('name', 'inchi' or 'cid')
+        '''
+        if namespace == 'cid':
+            return [int(identifier)]
+
+        def fetch(query):
+            result = self.post_or_empty(f'compound/{namespace}/cids/JSON', {namespace: query}, f'pc_{namespace}')
+            return result['IdentifierList']['CID'] if result else []
+
+        return self.lookup(f'pc_{namespace}_cids', identifier, fetch)
+
+    def properties(self, cids):
+        '''
+        Returns a dict of CID to stored properties for a list of CIDs.
+        Only CIDs that are not cached yet are requested, up to BATCH_SIZE CIDs per request.
+        '''
+        found = {}
+        missing = []
+        for cid in dict.fromkeys(cids):
+            if self.cache is not None:
+                hit, value = self.cache.get('pc_property', cid)
+                if hit:
+                    found[cid] = value
+                    continue
+            missing.append(cid)
+
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            result = self.post_or_empty(f"compound/cid/property/{','.join(PROPERTIES)}/JSON", {'cid': ','.join(map(str, batch))}, 'pc_property')
+
+            for properties in (result['PropertyTable']['Properties'] if result else []):
+                found[properties['CID']] = properties
+                if self.cache is not None:
+                    self.cache.set('pc_property', properties['CID'], properties)
+
+        return found
+
+    def synonyms(self, cids):
+        '''
+        Returns a dict of CID to its first SYNONYM_LIMIT synonyms for a list of CIDs, up to BATCH_SIZE CIDs per request
+        '''
+        found = {}
+        missing = []
+        for cid in dict.fromkeys(cids):
+            if self.cache is not None:
+                hit, value = self.cache.get('pc_synonyms', cid)
+                if hit:
+                    found[cid] = value
+                    continue
+            missing.append(cid)
+
+        for start in range(0, len(missing), BATCH_SIZE):
+            batch = missing[start:start + BATCH_SIZE]
+            result = self.post_or_empty("compound/cid/synonyms/JSON", {'cid': ','.join(map(str, batch))}, 'pc_synonyms')
+
+            for information in (result['InformationList']['Information'] if result else []):
+                found[information['CID']] = information.get('Synonym', [])[:SYNONYM_LIMIT]
+                if self.cache is not None:
+                    self.cache.set('pc_synonyms', information['CID'], found[information['CID']], empty=False)
+
+        return found
+
+    def get_compounds(self, identifier, namespace:str = 'name'):
+        '''
+        Same use as pubchempy.get_compounds, but returns PCRecord objects holding only the stored properties
+        '''
+        cids = self.cids(identifier, namespace)
+        properties = self.properties(cids)
+        return [PCRecord(properties[cid], self) for cid in cids if cid in properties]
+
+    def prefetch(self, identifiers, namespace:str = 'name'):
+        '''
+        Looks up the CIDs of many identifiers at once and retrieves the properties of all of them in as few requests as possible.
+        Results end up in the response cache, so later get_compounds calls for these identifiers need no requests.
+        '''
+        # Without a cache the prefetched results would be thrown away
+        if self.cache is None:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            cid_lists = list(pool.map(lambda identifier: self.cids(identifier, namespace), identifiers))
+
+        self.properties([cid for cids in cid_lists for cid in cids])
+
+    def records(self, identifier, namespace:str = 'name'):
+        '''
+        Returns the full compound records matching an identifier in the given namespace
+        '''
+        def fetch(query):
+            result = self.post_or_empty(f'compound/{namespace}/JSON', {namespace: query}, f'pc_{namespace}_record')
+            return result['PC_Compounds'] if result else []
+
+        return self.lookup(f'pc_{namespace}', identifier, fetch)
+
+    def get_full_compounds(self, identifier, namespace:str = 'name'):
+        '''
+        Same as pubchempy.get_compounds, returns a list of full pubchempy.Compound objects
+        '''
+        return [pubchempy.Compound(record) for record in self.records(identifier, namespace)]
+
+
+# One client is shared by all callers of the module level functions so they share connections and the rate limit
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''
+    Returns the shared PubChem client, creating it on first use
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PubChemClient(cache=api_cache.get_cache())
+    return _client
+
+def set_client(client):
+    '''
+    Replaces the shared PubChem client, for example with one pointing at another server or using other limits
+    '''
+    global _client
+    with _client_lock:
+        _client = client
+
+def get_compounds(identifier, namespace:str = 'name'):
+    '''
+    Returns a list of PCRecord objects for an identifier, served from the response cache when possible
+    '''
+    return get_client().get_compounds(identifier, namespace)
+
+def prefetch(identifiers, namespace:str = 'name'):
+    '''
+    Batches the PubChem lookups for many identifiers into the response cache
+    '''
+    get_client().prefetch(identifiers, namespace)
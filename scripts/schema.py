@@ -0,0 +1,134 @@
+"""
+Versioned schema migrations for dataset.db.
+The version of a database is tracked with PRAGMA user_version, running migrate() upgrades an existing database in place.
+Can be run standalone to upgrade a database file: python schema.py [database]
+"""
+import argparse
+import sqlite3
+
+import cas_properties
+import compounds
+import synonyms
+
+# Every migration is a list of statements, the position in this list (starting at 1) is the schema version it results in.
+# A statement can also be a function taking the connection, for data that has to be converted in Python.
+# Never change a migration that was released, add a new one instead.
+MIGRATIONS = [
+    # 1: skiplist table (previously created on connect, hence IF NOT EXISTS)
+    ['''CREATE TABLE IF NOT EXISTS Skiplist(entry_id INTEGER NOT NULL,
+                                           reason TEXT,
+                                           added_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                           PRIMARY KEY(entry_id),
+                                           FOREIGN KEY(entry_id) REFERENCES Compound_entries(id))'''],
+
+    # 2: indexes for the identification hot paths
+    [# UPDATE ... WHERE lower(compound_name) = ?
+     'CREATE INDEX IF NOT EXISTS Compound_entries_lower_name ON Compound_entries(lower(compound_name))',
+     # Entries that still need identification, only these rows are part of the index
+     'CREATE INDEX IF NOT EXISTS Compound_entries_unresolved ON Compound_entries(id) WHERE CAS_data_id IS NULL AND PC_data_id IS NULL',
+     # Foreign keys used in joins
+     'CREATE INDEX IF NOT EXISTS Compound_entries_CAS_data_id ON Compound_entries(CAS_data_id)',
+     'CREATE INDEX IF NOT EXISTS Compound_entries_PC_data_id ON Compound_entries(PC_data_id)',
+     'CREATE INDEX IF NOT EXISTS Compound_entries_experiment_id ON Compound_entries(experiment_id)',
+     'CREATE INDEX IF NOT EXISTS Experiments_paper_id ON Experiments(paper_id)'],
+
+    # 3: run journal of auto_identifier.py, one row per normalized compound name (see journal.py)
+    ['''CREATE TABLE Run_journal(name_key TEXT NOT NULL,
+                                 name TEXT NOT NULL,
+                                 status TEXT NOT NULL,
+                                 attempts INTEGER NOT NULL DEFAULT 1,
+                                 error TEXT,
+                                 finished_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                 PRIMARY KEY(name_key))''',
+     'CREATE INDEX Run_journal_status ON Run_journal(status, finished_at)'],
+
+    # 4: synonym index, every known name of the stored compounds (see synonyms.py)
+    ['''CREATE TABLE Synonyms(name_key TEXT NOT NULL,
+                              name TEXT NOT NULL,
+                              source TEXT NOT NULL,
+                              record TEXT NOT NULL,
+                              PRIMARY KEY(name_key, source, record)) WITHOUT ROWID''',
+     synonyms.backfill],
+
+    # 5: list fields of CAS records as JSON instead of Python representations, experimental properties as rows (see cas_properties.py)
+    ['''CREATE TABLE CAS_properties(cas_rn TEXT NOT NULL,
+                                    name TEXT,
+                                    value REAL,
+                                    unit TEXT,
+                                    raw TEXT,
+                                    source_number INTEGER,
+                                    FOREIGN KEY(cas_rn) REFERENCES CAS_data(cas_rn))''',
+     'CREATE INDEX CAS_properties_name_value ON CAS_properties(name, value)',
+     'CREATE INDEX CAS_properties_cas_rn ON CAS_properties(cas_rn)',
+     cas_properties.convert],
+
+    # 6: duplicate check of compound_loader.py, one name per experiment
+    ['CREATE INDEX Compound_entries_name_experiment ON Compound_entries(compound_name, experiment_id)'],
+
+    # 7: registry of distinct compounds by InChIKey, referenced by an integer compound_id (see compounds.py)
+    ['''CREATE TABLE Compounds(id INTEGER PRIMARY KEY,
+                               inchikey TEXT NOT NULL UNIQUE,
+                               inchi TEXT)''',
+     'CREATE INDEX Compounds_inchi ON Compounds(inchi)',
+     'ALTER TABLE CAS_data ADD COLUMN compound_id INTEGER REFERENCES Compounds(id)',
+     'ALTER TABLE PC_data ADD COLUMN compound_id INTEGER REFERENCES Compounds(id)',
+     'ALTER TABLE Compound_entries ADD COLUMN compound_id INTEGER REFERENCES Compounds(id)',
+     'ALTER TABLE Ecotoxicity ADD COLUMN compound_id INTEGER REFERENCES Compounds(id)',
+     'CREATE INDEX CAS_data_compound_id ON CAS_data(compound_id)',
+     'CREATE INDEX PC_data_compound_id ON PC_data(compound_id)',
+     'CREATE INDEX Compound_entries_compound_id ON Compound_entries(compound_id)',
+     'CREATE INDEX Ecotoxicity_compound_id ON Ecotoxicity(compound_id)',
+     compounds.backfill],
+
+    # 8: translation of the ids in the EPI suite input files to InChIs, written by episuite_input.py and read by epi_processor.py
+    ['''CREATE TABLE EPI_translation(epi_id TEXT NOT NULL,
+                                     inchi TEXT NOT NULL,
+                                     compound_id INTEGER REFERENCES Compounds(id),
+                                     PRIMARY KEY(epi_id))'''],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_version(conn):
+    '''
+    Returns the schema version of a database
+    '''
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    '''
+    Applies all migrations the database does not have yet, each in its own transaction together with the new version number.
+    Returns the amount of applied migrations.
+    '''
+    version = get_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database has schema version {version}, these scripts only know up to version {SCHEMA_VERSION}")
+
+    for number, statements in enumerate(MIGRATIONS[version:], version + 1):
+        # The sqlite3 module does not start transactions for CREATE statements by itself, so it is done explicitly.
+        # This way a migration is committed completely together with its version number, or not at all
+        conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    return SCHEMA_VERSION - version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('database', nargs='?', default="dataset.db", help="Database file to upgrade")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    print(f"Schema version {get_version(conn)}")
+    applied = migrate(conn)
+    print(f"Applied {applied} migrations, schema version is now {get_version(conn)}")
+    conn.close()
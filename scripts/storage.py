@@ -0,0 +1,237 @@
+"""
+Storage layer for the identifier scripts.
+The database is used in WAL mode and writes are grouped in transactions instead of committing after every statement.
+"""
+import contextlib
+import sqlite3
+import time
+
+import json
+
+import cas_properties
+import compounds
+import metrics
+import schema
+import synonyms
+
+# Commit after this many compounds or this many seconds, whichever comes first
+COMMIT_EVERY = 50
+COMMIT_INTERVAL = 5.0 # seconds
+
+def connect(db_path:str = "dataset.db"):
+    '''
+    Opens the database in WAL mode and upgrades it to the current schema.
+    In WAL mode a commit only needs to append to the log, and readers are not blocked by the writer.
+    Together with synchronous=NORMAL a crash can lose the last transactions, but never corrupts the database.
+    '''
+    conn = sqlite3.Connection(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+    # Bring older databases up to the current schema
+    schema.migrate(conn)
+
+    return conn
+
+class BatchCommitter:
+    '''
+    Commits the writes of several compounds at once: after every `every` compounds or `interval` seconds.
+    Everything stored for one compound is committed together, so a crash only loses whole compounds, which are identified again on the next run.
+    '''
+
+    def __init__(self, conn, every:int = COMMIT_EVERY, interval:float = COMMIT_INTERVAL):
+        self.conn = conn
+        self.every = every
+        self.interval = interval
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def tick(self):
+        '''
+        Call after every processed compound, commits when a batch is full or old enough
+        '''
+        self.pending += 1
+        self.commit_due()
+
+    def commit_due(self):
+        '''
+        Commits pending writes when the interval has passed, also useful while waiting for new work
+        '''
+        if self.pending >= self.every or (self.pending and time.monotonic() - self.last_commit >= self.interval):
+            self.flush()
+
+    def flush(self):
+        '''
+        Commits all pending writes
+        '''
+        with metrics.timer('db_commit_seconds'):
+            self.conn.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    @contextlib.contextmanager
+    def compound(self):
+        '''
+        Groups the writes of one compound in a savepoint, an exception rolls back only these writes.
+        The pending writes of earlier compounds stay in the transaction and are committed by the next flush
+        '''
+        # Releasing a savepoint that started the transaction would commit it, so the transaction is started first
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN')
+        self.conn.execute('SAVEPOINT compound')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK TO compound')
+            self.conn.execute('RELEASE compound')
+            raise
+        self.conn.execute('RELEASE compound')
+
+def add_pc_data(pc_data, conn, cur):
+    '''
+    Add pubchem data if this cid is not yet in the dataset, and its names to the synonym index
+    Does not commit, see BatchCommitter
+    '''
+
+    # Creates dict version from the PubChem record, with its synonyms and structure when they were retrieved (see PCRecord.load_details).
+    # Storing never makes API requests, so the retrieval is done by the caller before
+    pc_data = pc_data.to_dict()
+
+    # Create a tuple of the data to store in the correct order
+    write_data = (pc_data['cid'],
+                  str(pc_data['elements']) if pc_data['elements'] is not None else None,
+                  str(pc_data['atoms']) if pc_data['atoms'] is not None else None,
+                  str(pc_data['bonds']) if pc_data['bonds'] is not None else None,
+                  json.dumps(pc_data['synonyms'], ensure_ascii=False) if pc_data.get('synonyms') is not None else None,
+                  str(pc_data['molecular_formula']),
+                  pc_data['molecular_weight'],
+                  pc_data['canonical_smiles'],
+                  pc_data['isomeric_smiles'],
+                  pc_data['inchi'],
+                  pc_data['inchikey'],
+                  pc_data['iupac_name'],
+                  pc_data['xlogp'],
+                  pc_data['exact_mass'],
+                  pc_data['monoisotopic_mass'],
+                  compounds.register(cur, pc_data['inchikey'], pc_data['inchi']))
+
+    # create the actual record in the database
+    cur.execute('''INSERT INTO PC_data(cid,
+                                        elements,
+                                        atoms,
+                                        bonds,
+                                        synonyms,
+                                        molecular_formula,
+                                        molecular_weight,
+                                        canonical_smiles,
+                                        isometric_smiles,
+                                        inchi,
+                                        inchikey,
+                                        iupac_name,
+                                        xlogp,
+                                        exact_mass,
+                                        monoisotopic_mass,
+                                        compound_id)
+                                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                                    ON CONFLICT(cid) DO NOTHING''', write_data)
+
+    synonyms.add_pc(cur, pc_data['cid'], pc_data['iupac_name'], pc_data.get('synonyms'))
+    return True
+
+def add_cas_data(cas_data, conn, cur):
+    '''
+    Adds cas data to the table if the CAS nr is not yet in the table, and its names to the synonym index
+    List fields are stored as JSON, the experimental properties also in the CAS_properties table
+    Does not commit, see BatchCommitter
+    '''
+
+    # Create a tuple of the data to store in the correct order
+    data = (str(cas_data['rn']),
+            str(cas_data['uri']),
+            str(cas_data['name']),
+            str(cas_data['smile']),
+            str(cas_data['canonicalSmile']),
+            str(cas_data['inchi']),
+            str(cas_data['inchiKey']),
+            str(cas_data['molecularFormula']),
+            str(cas_data['molecularMass']),
+            cas_properties.to_json(cas_data['experimentalProperties']),
+            cas_properties.to_json(cas_data['propertyCitations']),
+            cas_properties.to_json(cas_data['synonyms']),
+            cas_properties.to_json(cas_data['replacedRns']),
+            compounds.register(cur, cas_data['inchiKey'], cas_data['inchi']))
+
+    # create the actual record in the database
+    cur.execute('''INSERT INTO CAS_data(cas_rn,
+                                        uri,
+                                        name,
+                                        smile,
+                                        canonical_smile,
+                                        inchi,
+                                        inchikey,
+                                        molecular_formula,
+                                        molecular_weight,
+                                        documented_properties,
+                                        sources,
+                                        synonyms,
+                                        replaced_cas,
+                                        compound_id)
+                                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                                    ON CONFLICT(cas_rn) DO NOTHING''', data)
+
+    # Records that were already stored keep their properties
+    if cur.rowcount:
+        cas_properties.add_properties(cur, cas_data['rn'], cas_data['experimentalProperties'])
+
+    synonyms.add_cas(cur, cas_data['rn'], cas_data['name'], cas_data['synonyms'])
+    return True
+
+def store_data(entry_name, cas_find, pc_find, conn, cur, entry_ids=None):
+    '''
+    Stores all available API data in the database and makes sure the compound is referencing the correct API data records
+    When entry_ids is given (see names.build_work_set) exactly these entries are updated, otherwise all entries with the same name
+    Does not commit, all writes for one compound become part of the same transaction
+    The time spent is recorded in the db_store_seconds metric
+    '''
+
+    with metrics.timer('db_store_seconds'):
+        # Sets empty flags to be replaced by the PubChem or CAS identifier if available, if no identifier is available for either service, this remains None (thus empty).
+        cas = None
+        pc = None
+
+        # Stores CAS API data if available
+        if cas_find:
+            add_cas_data(cas_find, conn, cur)
+            cas = cas_find['rn']
+
+        # Stores PubChem data if available
+        if pc_find:
+            add_pc_data(pc_find, conn, cur)
+            pc = pc_find.cid
+
+        link_data(entry_name, cas, pc, cur, entry_ids)
+
+def link_data(entry_name, cas_rn, cid, cur, entry_ids=None):
+    '''
+    Makes the entries reference already stored CAS and PubChem records and their compound (see compounds.py),
+    and adds the entry name to the synonym index
+    When entry_ids is given exactly these entries are updated, otherwise all entries with the same name
+    Does not commit
+    '''
+    # Add identifiers to the compound referencing the correct data records.
+    # By design this is done for every compound with the same name to for efficiency
+    # The compound is the one of the CAS record, or of the PubChem record when there is no CAS record
+    cur.execute('SELECT COALESCE((SELECT compound_id FROM CAS_data WHERE cas_rn = ?), (SELECT compound_id FROM PC_data WHERE cid = ?))', (cas_rn, cid))
+    compound_id = cur.fetchone()[0]
+
+    if entry_ids:
+        cur.executemany('UPDATE Compound_entries SET PC_data_id = ?, CAS_data_id = ?, compound_id = ? WHERE id = ?', [(cid, cas_rn, compound_id, entry_id) for entry_id in entry_ids])
+    else:
+        cur.execute('UPDATE Compound_entries SET PC_data_id = ?, CAS_data_id = ?, compound_id = ? WHERE lower(compound_name) = ?', (cid, cas_rn, compound_id, entry_name.lower()))
+
+    # The next entry with this name resolves without API requests
+    if cas_rn is not None:
+        synonyms.add_names(cur, [entry_name], synonyms.CAS, cas_rn)
+    if cid is not None:
+        synonyms.add_names(cur, [entry_name], synonyms.PUBCHEM, cid)
+   
@@ -0,0 +1,108 @@
+"""
+Local index of every known name of the stored compounds, the "Synonyms" table of dataset.db.
+Holds the normalized CAS names and synonyms, PubChem IUPAC names and synonyms and the names of already identified entries,
+so a compound name that is already known resolves without any API request.
+"""
+import ast
+import json
+
+from names import normalize_name
+
+# The table a record of the index refers to
+CAS = "CAS"
+PUBCHEM = "PubChem"
+
+def parse_list(value):
+    '''
+    Reads a stored list of names, stored as JSON or as the Python representation used by older versions of the scripts
+    '''
+    if not value:
+        return []
+    try:
+        result = json.loads(value)
+    except ValueError:
+        try:
+            result = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return []
+    return [name for name in result if isinstance(name, str)] if isinstance(result, list) else []
+
+def add_names(cur, names, source:str, record):
+    '''
+    Adds names for a CAS record (source CAS, record is the CAS number) or PubChem record (source PubChem, record is the CID)
+    Does not commit
+    '''
+    rows = {}
+    for name in names:
+        if name and name.strip():
+            rows.setdefault(normalize_name(name), name.strip())
+
+    cur.executemany('INSERT OR IGNORE INTO Synonyms(name_key, name, source, record) VALUES (?,?,?,?)',
+                    [(key, name, source, str(record)) for key, name in rows.items()])
+
+def add_cas(cur, cas_rn, name, synonyms):
+    add_names(cur, [name] + list(synonyms or []), CAS, cas_rn)
+
+def add_pc(cur, cid, iupac_name, synonyms):
+    add_names(cur, [iupac_name] + list(synonyms or []), PUBCHEM, cid)
+
+def lookup(cur, name:str):
+    '''
+    Returns (CAS number, CID) of the compound known under this name, either can be None.
+    A name that refers to more than one CAS record or more than one PubChem record is ambiguous, for those (None, None) is returned.
+    A CAS and PubChem record are only returned together when they belong to the same compound (see compounds.py),
+    otherwise the name is ambiguous as well. A name only known for one of the records is completed with the stored record
+    of the other service for the same compound.
+    '''
+    cur.execute('SELECT source, record FROM Synonyms WHERE name_key = ?', (normalize_name(name),))
+
+    records = {CAS: set(), PUBCHEM: set()}
+    for source, record in cur.fetchall():
+        records[source].add(record)
+
+    if len(records[CAS]) > 1 or len(records[PUBCHEM]) > 1:
+        return None, None
+
+    cas_rn = next(iter(records[CAS]), None)
+    cid = next(iter(records[PUBCHEM]), None)
+
+    if cas_rn is not None and cid is not None:
+        cur.execute('''SELECT 1 FROM CAS_data JOIN PC_data ON PC_data.compound_id = CAS_data.compound_id
+                       WHERE CAS_data.cas_rn = ? AND PC_data.cid = ?''', (cas_rn, int(cid)))
+        if cur.fetchone() is None:
+            return None, None
+
+    # Complete the missing side from the compound registry, when exactly one stored record of the other service belongs to the compound
+    if cas_rn is not None and cid is None:
+        cur.execute('''SELECT PC_data.cid FROM CAS_data JOIN PC_data ON PC_data.compound_id = CAS_data.compound_id
+                       WHERE CAS_data.cas_rn = ?''', (cas_rn,))
+        matches = cur.fetchall()
+        if len(matches) == 1:
+            cid = matches[0][0]
+    elif cid is not None and cas_rn is None:
+        cur.execute('''SELECT CAS_data.cas_rn FROM PC_data JOIN CAS_data ON CAS_data.compound_id = PC_data.compound_id
+                       WHERE PC_data.cid = ?''', (int(cid),))
+        matches = cur.fetchall()
+        if len(matches) == 1:
+            cas_rn = matches[0][0]
+
+    return cas_rn, int(cid) if cid is not None else None
+
+def backfill(conn):
+    '''
+    Fills the index from all stored CAS and PubChem records and identified entries, used by the schema migration
+    '''
+    cur = conn.cursor()
+
+    for cas_rn, name, synonyms in conn.execute('SELECT cas_rn, name, synonyms FROM CAS_data').fetchall():
+        add_cas(cur, cas_rn, name, parse_list(synonyms))
+
+    for cid, iupac_name, synonyms in conn.execute('SELECT cid, iupac_name, synonyms FROM PC_data').fetchall():
+        add_pc(cur, cid, iupac_name, parse_list(synonyms))
+
+    for name, cas_rn, cid in conn.execute('''SELECT compound_name, CAS_data_id, PC_data_id FROM Compound_entries
+                                             WHERE CAS_data_id IS NOT NULL OR PC_data_id IS NOT NULL''').fetchall():
+        if cas_rn is not None:
+            add_names(cur, [name], CAS, cas_rn)
+        if cid is not None:
+            add_names(cur, [name], PUBCHEM, cid)
@@ -0,0 +1,52 @@
+"""
+Work queue for the identifier scripts, replaces polling the database for the next entry after every compound.
+"""
+import threading
+
+import names
+
+
+class WorkQueue:
+    '''
+    All distinct (normalized) compound names that still need identification, read from the database once.
+    Iterating yields the work items ({'name': ..., 'ids': [...]}, see names.build_work_set) one at a time,
+    progress is counted in memory so every step costs the same no matter how large the dataset or skiplist is.
+    Normalized names in exclude (for example names already tried by an earlier run, see journal.py) are left out.
+    '''
+
+    def __init__(self, cur, skipped:bool = True, exclude=()):
+        self.items = [item for key, item in names.build_work_set(cur, skipped).items() if key not in exclude]
+        self.total = len(self.items)
+
+        # Counts per outcome ("full", "partial", "failure", "skipped", ...), may be updated from several threads
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for item in self.items:
+            yield item
+
+    def __len__(self):
+        return self.total
+
+    def batches(self, size:int):
+        '''
+        Yields the work items in lists of at most size items
+        '''
+        for start in range(0, self.total, size):
+            yield self.items[start:start + size]
+
+    def mark(self, item, outcome:str):
+        '''
+        Records the outcome of a work item
+        '''
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    @property
+    def done(self):
+        return sum(self.counts.values())
+
+    @property
+    def remaining(self):
+        return self.total - self.done